@@ -2,19 +2,78 @@
 AI-powered meeting analysis using GPT-5
 """
 
+import asyncio
+import functools
+import json
 import os
 from datetime import datetime
 from typing import List, Dict, Optional
 from pathlib import Path
-from openai import OpenAI
+import tiktoken
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
+from semantic_cache import SemanticCache
+
 load_dotenv()
 
+SEP = '=' * 80
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding():
+    """Load the tokenizer once, None if it can't be loaded (it is downloaded on first use)"""
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")  # same o200k_base encoding as GPT-5
+    except Exception as e:
+        print(f"Warning: Could not load tiktoken encoding, estimating token counts: {e}")
+        return None
+
 
 class MeetingAnalyzer:
     """Analyzes meeting transcripts using GPT-5"""
 
+    MODEL = "gpt-5"  # Using GPT-5 (released August 2025)
+
+    SYSTEM_PROMPT = "You are an expert executive coach specializing in engineering leadership development."
+
+    # Cap on concurrent per-meeting requests
+    MAX_CONCURRENT_ANALYSES = 8
+
+    # Input budget per request, well inside GPT-5's context window
+    MAX_PROMPT_TOKENS = 100_000
+
+    # Size of the meetings digest the response cache embeds (the embedding model takes 8191)
+    EMBEDDING_DIGEST_TOKENS = 6000
+
+    MEETING_PROMPT = """Review the meeting below and write concise coaching notes for it.
+
+Reply with short bullets under:
+- STRENGTHS
+- AREAS FOR IMPROVEMENT
+- ACTION ITEMS
+
+Quote specific moments as examples. If the meeting is non-professional (doctors appointments, personal calls, etc.)
+or has no useful data, reply with just: SKIP"""
+
+    REPORT_PROMPT = """Analyze today's meetings and provide actionable feedback.
+
+Guidelines:
+- Exclude non-professional meetings (doctors appointments, personal calls, etc.)
+- Skip meetings without useful data
+- Be specific with examples
+- Focus on actionable improvements
+- Don't force insights if insufficient information
+
+Provide comprehensive feedback with:
+- STRENGTHS (what went well)
+- AREAS FOR IMPROVEMENT (specific suggestions)
+- ACTION ITEMS (what to do next)
+- OVERALL ASSESSMENT (summary)"""
+
+    # Batch API statuses that mean the result isn't ready yet
+    BATCH_PENDING_STATUSES = ('validating', 'in_progress', 'finalizing', 'cancelling')
+
     DEFAULT_PROMPT = """You are an executive coach analyzing meeting effectiveness and productivity.
 
 Focus on these key areas:
@@ -36,6 +95,10 @@ Focus on these key areas:
         self.people = os.getenv('PEOPLE', '')
         self.custom_prompt = self._load_custom_prompt()
 
+        # Reuse feedback for repeat or near-identical meeting bundles
+        script_dir = Path(__file__).parent.absolute()
+        self.cache = SemanticCache(self.client, str(script_dir / '.response_cache.sqlite'))
+
     def _load_custom_prompt(self) -> Optional[str]:
         """Load custom prompt from .prompt file if it exists"""
         # Use absolute path based on script location for cron compatibility
@@ -48,31 +111,29 @@ Focus on these key areas:
                 print(f"Warning: Could not load .prompt file: {e}")
         return None
 
-    def analyze_meetings(self, meetings: List[Dict], previous_feedback: str = None) -> Dict:
-        """Analyze multiple meetings and generate comprehensive feedback"""
-        if not meetings:
-            return {
-                'summary': 'No meetings found in the specified date range.',
-                'feedback': 'No meetings to analyze.',
-                'date': datetime.now().strftime("%Y-%m-%d")
-            }
-
-        # Combine all meeting transcripts
-        all_meetings_text = ""
-        for meeting in meetings:
-            title = meeting.get('title', 'Untitled Meeting')
-            created_at = meeting.get('created_at', 'Unknown date')
-            transcript_text = meeting.get('transcript_text', '')
-
-            all_meetings_text += f"\n{'='*80}\n"
-            all_meetings_text += f"Meeting: {title}\n"
-            all_meetings_text += f"Date: {created_at}\n"
-            all_meetings_text += f"{'='*80}\n"
-            all_meetings_text += transcript_text + "\n\n"
+    def _build_system_prompt(self, instructions: str) -> str:
+        """Build the static part of a request
 
+        Must stay byte-identical between runs (no dates, people or feedback)
+        so the API's automatic prompt caching can reuse the prefix.
+        """
         # Use custom prompt if available, otherwise use default
         base_prompt = self.custom_prompt if self.custom_prompt else self.DEFAULT_PROMPT
 
+        return f"""{self.SYSTEM_PROMPT}
+
+{base_prompt}
+
+{instructions}"""
+
+    def _build_prompt(self, meetings: List[Dict], previous_feedback: str = None,
+                      texts: Optional[List[str]] = None) -> str:
+        """Build the per-run part of the analysis request
+
+        `texts` replaces each meeting's transcript (e.g. with per-meeting notes).
+        """
+        all_meetings_text = self._format_meetings(meetings, texts)
+
         # Build context
         context_parts = []
 
@@ -82,41 +143,240 @@ Focus on these key areas:
         if previous_feedback:
             context_parts.append(f"Previous feedback for context:\n{previous_feedback}")
 
-        context = "\n\n".join(context_parts) if context_parts else ""
+        context_parts.append(f"TODAY'S MEETINGS:\n{all_meetings_text}")
 
-        # Generate analysis prompt
-        prompt = f"""{base_prompt}
+        return "\n\n".join(context_parts)
 
-{context}
+    def _format_meetings(self, meetings: List[Dict], texts: Optional[List[str]] = None) -> str:
+        """Render each meeting's header and transcript (or `texts` entry)"""
+        if texts is None:
+            texts = [meeting.get('transcript_text', '') for meeting in meetings]
 
-Analyze today's meetings and provide actionable feedback.
+        # Combine all meeting transcripts (joined once, not grown with +=)
+        parts = []
+        for meeting, transcript_text in zip(meetings, texts):
+            title = meeting.get('title', 'Untitled Meeting')
+            created_at = meeting.get('created_at', 'Unknown date')
+            parts.append(f"\n{SEP}\nMeeting: {title}\nDate: {created_at}\n{SEP}\n{transcript_text}\n\n")
+        return ''.join(parts)
 
-Guidelines:
-- Exclude non-professional meetings (doctors appointments, personal calls, etc.)
-- Skip meetings without useful data
-- Be specific with examples
-- Focus on actionable improvements
-- Don't force insights if insufficient information
+    def _build_messages(self, meetings: List[Dict], previous_feedback: str = None,
+                        texts: Optional[List[str]] = None) -> List[Dict]:
+        """Build the chat messages sent to the model"""
+        return [
+            {"role": "system", "content": self._build_system_prompt(self.REPORT_PROMPT)},
+            {"role": "user", "content": self._build_prompt(meetings, previous_feedback, texts)}
+        ]
 
-TODAY'S MEETINGS:
-{all_meetings_text}
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens in text (roughly 4 characters per token if tiktoken is unavailable)"""
+        encoding = _get_encoding()
+        if encoding is None:
+            return len(text) // 4 + 1
+        return len(encoding.encode(text, disallowed_special=()))
 
-Provide comprehensive feedback with:
-- STRENGTHS (what went well)
-- AREAS FOR IMPROVEMENT (specific suggestions)
-- ACTION ITEMS (what to do next)
-- OVERALL ASSESSMENT (summary)"""
+    def _clip_tokens(self, text: str, limit: int, keep_end: bool = False) -> str:
+        """Cut text down to its first (or with keep_end, last) `limit` tokens"""
+        encoding = _get_encoding()
+        if encoding is None:
+            size = max(limit - 1, 0) * 4  # stays within the 4-characters-per-token estimate
+            return (text[-size:] if size else '') if keep_end else text[:size]
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[-limit:] if keep_end and limit else tokens[:limit])
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-5",  # Using GPT-5 (released August 2025)
+    def _embedding_digest(self, meetings: List[Dict]) -> str:
+        """Bounded stand-in for the meetings text, for the cache's similarity tier
+
+        Each meeting keeps its header and an equal share of the budget, taken from
+        the start and end of its transcript so a transcript that grew still differs.
+        """
+        share = self.EMBEDDING_DIGEST_TOKENS // len(meetings)
+        texts = []
+        for meeting in meetings:
+            transcript_text = meeting.get('transcript_text', '')
+            if self._meeting_tokens(meeting) > share:
+                transcript_text = (self._clip_tokens(transcript_text, share // 2) + "\n...\n"
+                                   + self._clip_tokens(transcript_text, share // 2, keep_end=True))
+            texts.append(transcript_text)
+        return self._format_meetings(meetings, texts)
+
+    def _token_chunks(self, text: str, limit: int) -> List[str]:
+        """Cut text into consecutive pieces of at most `limit` tokens each"""
+        encoding = _get_encoding()
+        if encoding is None:
+            size = max(limit - 1, 1) * 4
+            return [text[i:i + size] for i in range(0, len(text), size)]
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + limit]) for i in range(0, len(tokens), limit)]
+
+    def _meeting_tokens(self, meeting: Dict) -> int:
+        """Token count of a meeting's transcript, cached on the meeting dict"""
+        if 'transcript_tokens' not in meeting:
+            meeting['transcript_tokens'] = self._count_tokens(meeting.get('transcript_text', ''))
+        return meeting['transcript_tokens']
+
+    def _split_transcript(self, meeting: Dict) -> List[str]:
+        """Split a transcript on line boundaries into parts that fit MAX_PROMPT_TOKENS
+
+        A single line over the budget (e.g. an unpunctuated dictation) is cut by tokens.
+        """
+        transcript_text = meeting.get('transcript_text', '')
+        if self._meeting_tokens(meeting) <= self.MAX_PROMPT_TOKENS:
+            return [transcript_text]
+
+        parts, current, current_tokens = [], [], 0
+        for line in transcript_text.split('\n'):
+            line_tokens = self._count_tokens(line) + 1  # +1 for the newline
+            if line_tokens > self.MAX_PROMPT_TOKENS:
+                if current:
+                    parts.append('\n'.join(current))
+                    current, current_tokens = [], 0
+                parts.extend(self._token_chunks(line, self.MAX_PROMPT_TOKENS))
+                continue
+            if current and current_tokens + line_tokens > self.MAX_PROMPT_TOKENS:
+                parts.append('\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            parts.append('\n'.join(current))
+        return parts
+
+    def _fit_report_notes(self, meetings: List[Dict], notes: List[str],
+                          previous_feedback: Optional[str]) -> List[str]:
+        """Trim the per-meeting notes so the combined report request fits MAX_PROMPT_TOKENS
+
+        Notes under an equal share of the budget are kept whole and the rest
+        share what is left, so one long meeting can't crowd out the others.
+        """
+        overhead = sum(
+            self._count_tokens(message['content'])
+            for message in self._build_messages(meetings, previous_feedback, texts=[''] * len(notes))
+        )
+        counts = [self._count_tokens(note) for note in notes]
+        budget = self.MAX_PROMPT_TOKENS - overhead
+        if sum(counts) <= budget:
+            return notes
+
+        print(f"Warning: Meeting notes total {sum(counts):,} tokens, trimming them to fit the "
+              f"{self.MAX_PROMPT_TOKENS:,} token budget")
+        fitted = list(notes)
+        remaining = max(budget, 0)
+        by_size = sorted(range(len(notes)), key=counts.__getitem__)
+        for position, index in enumerate(by_size):
+            share = remaining // (len(notes) - position)
+            if counts[index] > share:
+                fitted[index] = self._clip_tokens(notes[index], share)
+                remaining -= share
+            else:
+                remaining -= counts[index]
+        return fitted
+
+    async def _analyze_part(self, client: AsyncOpenAI, semaphore: asyncio.Semaphore, meeting: Dict,
+                            transcript_text: str, label: str = "") -> str:
+        """Write coaching notes for one transcript (or part of one)"""
+        prompt = f"""Meeting: {meeting.get('title', 'Untitled Meeting')}{label}
+Date: {meeting.get('created_at', 'Unknown date')}
+
+{transcript_text}"""
+        if self.people:
+            prompt = f"People involved: {self.people}\n\n{prompt}"
+
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=self.MODEL,
                 messages=[
-                    {"role": "system", "content": "You are an expert executive coach specializing in engineering leadership development."},
+                    {"role": "system", "content": self._build_system_prompt(self.MEETING_PROMPT)},
                     {"role": "user", "content": prompt}
                 ],
             )
+        return response.choices[0].message.content or ''
+
+    async def _analyze_one(self, client: AsyncOpenAI, semaphore: asyncio.Semaphore, meeting: Dict) -> str:
+        """Write coaching notes for a single meeting, in parts if it is over the token budget"""
+        parts = self._split_transcript(meeting)
+        if len(parts) == 1:
+            return await self._analyze_part(client, semaphore, meeting, parts[0])
+
+        notes = await asyncio.gather(*[
+            self._analyze_part(client, semaphore, meeting, text, f" (part {i} of {len(parts)})")
+            for i, text in enumerate(parts, 1)
+        ])
+        kept = [n for n in notes if n.strip() != 'SKIP']
+        return "\n\n".join(kept) if kept else 'SKIP'
+
+    async def _analyze_all(self, meetings: List[Dict]) -> List[str]:
+        """Analyze every meeting concurrently, returns notes in meeting order"""
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_ANALYSES)
+        async with AsyncOpenAI(api_key=self.api_key) as client:
+            results = await asyncio.gather(
+                *[self._analyze_one(client, semaphore, meeting) for meeting in meetings],
+                return_exceptions=True
+            )
+
+        notes = []
+        for meeting, result in zip(meetings, results):
+            if isinstance(result, Exception):
+                # Keep going with the meetings that worked, fail only if none did
+                print(f"Warning: Failed to analyze {meeting.get('title', 'Unknown')}: {result}")
+                if all(isinstance(r, Exception) for r in results):
+                    raise result
+                result = 'Analysis unavailable for this meeting.'
+            notes.append(result)
+        return notes
+
+    def analyze_meetings(self, meetings: List[Dict], previous_feedback: str = None) -> Dict:
+        """Analyze multiple meetings and generate comprehensive feedback"""
+        if not meetings:
+            return {
+                'summary': 'No meetings found in the specified date range.',
+                'feedback': 'No meetings to analyze.',
+                'date': datetime.now().strftime("%Y-%m-%d")
+            }
+
+        # The exact tier keys on the instructions and the transcripts, not the previous
+        # feedback. The similarity tier only compares a digest of the meetings themselves,
+        # since the shared instructions would make any two days look alike, and only
+        # accepts a hit for the same set of meetings
+        cache_key = self._build_system_prompt(self.REPORT_PROMPT) + self._build_prompt(meetings)
+        meetings_digest = self._embedding_digest(meetings)
+        cache_scope = ','.join(sorted(str(m.get('id', '')) for m in meetings))
+        cached_feedback = self.cache.get(cache_key, meetings_digest, cache_scope) if self.cache else None
+        if cached_feedback:
+            return {
+                'summary': f"Analyzed {len(meetings)} meetings from today (cached)",
+                'feedback': cached_feedback,
+                'date': datetime.now().strftime("%Y-%m-%d"),
+                'num_meetings': len(meetings)
+            }
+
+        total_tokens = sum(self._meeting_tokens(m) for m in meetings)
+        print(f"Transcripts total ~{total_tokens:,} tokens across {len(meetings)} meetings")
+
+        try:
+            # Map: per-meeting notes in parallel, each in a small context
+            notes = asyncio.run(self._analyze_all(meetings))
+
+            # Drop meetings the per-meeting pass flagged as not worth reporting on
+            kept = [(m, n) for m, n in zip(meetings, notes) if n.strip() != 'SKIP']
+            if kept:
+                report_meetings, notes = [m for m, _ in kept], [n for _, n in kept]
+            else:
+                report_meetings = meetings
+
+            # Reduce: combine the notes into the daily report. The previous feedback gets at most
+            # a quarter of the budget, the notes are trimmed to fit the rest
+            if previous_feedback and self._count_tokens(previous_feedback) > self.MAX_PROMPT_TOKENS // 4:
+                previous_feedback = self._clip_tokens(previous_feedback, self.MAX_PROMPT_TOKENS // 4)
+            notes = self._fit_report_notes(report_meetings, notes, previous_feedback)
+            response = self.client.chat.completions.create(
+                model=self.MODEL,
+                messages=self._build_messages(report_meetings, previous_feedback, texts=notes),
+            )
 
             feedback = response.choices[0].message.content
+            if feedback and self.cache:
+                self.cache.put(cache_key, feedback, meetings_digest, cache_scope)
 
             return {
                 'summary': f"Analyzed {len(meetings)} meetings from today",
@@ -133,6 +393,99 @@ Provide comprehensive feedback with:
                 'num_meetings': len(meetings)
             }
 
+    def submit_batch(self, meetings: List[Dict], previous_feedback: str = None) -> Dict:
+        """Submit the analysis through the Batch API (24h window, half the cost)
+
+        Returns the pending batch record; pass it to collect_batch() later.
+        Raises ValueError if the meetings don't fit in one request.
+        """
+        messages = self._build_messages(meetings, previous_feedback)
+
+        # The batch is a single request, so the whole bundle has to fit the budget
+        prompt_tokens = sum(self._count_tokens(message['content']) for message in messages)
+        if prompt_tokens > self.MAX_PROMPT_TOKENS:
+            raise ValueError(f"Batch request would be ~{prompt_tokens:,} tokens, "
+                             f"over the {self.MAX_PROMPT_TOKENS:,} token budget")
+
+        date = datetime.now().strftime("%Y-%m-%d")
+        request = {
+            "custom_id": date,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.MODEL,
+                "messages": messages
+            }
+        }
+        batch_input = json.dumps(request) + "\n"
+
+        input_file = self.client.files.create(
+            file=(f"analysis_{date}.jsonl", batch_input.encode('utf-8')),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+
+        return {
+            'batch_id': batch.id,
+            'date': date,
+            'num_meetings': len(meetings),
+            'meeting_ids': [m['id'] for m in meetings if 'id' in m]
+        }
+
+    def collect_batch(self, batch: Dict) -> Optional[Dict]:
+        """Fetch the result of a submitted batch
+
+        Returns None while the batch is still running, otherwise an analysis
+        result in the same shape as analyze_meetings(). Batches that expired,
+        failed or were cancelled come back with an 'error' key instead.
+        """
+        num_meetings = batch.get('num_meetings', 0)
+        status = self.client.batches.retrieve(batch['batch_id'])
+
+        if status.status in self.BATCH_PENDING_STATUSES:
+            return None
+
+        try:
+            if status.status != 'completed':
+                raise Exception(f"batch {status.status}")
+
+            # A request that failed is written to the error file instead of the output file
+            file_id = status.output_file_id or status.error_file_id
+            if not file_id:
+                raise Exception("batch completed without output")
+
+            output = self.client.files.content(file_id).text
+            line = json.loads(output.strip().splitlines()[0])
+            if line.get('error'):
+                raise Exception(line['error'].get('message', line['error']))
+
+            response = line['response']
+            if response.get('status_code') != 200:
+                error = (response.get('body') or {}).get('error') or {}
+                raise Exception(error.get('message', f"request failed with status {response.get('status_code')}"))
+
+            feedback = response['body']['choices'][0]['message']['content']
+
+            return {
+                'summary': f"Analyzed {num_meetings} meetings from {batch['date']}",
+                'feedback': feedback,
+                'date': batch['date'],
+                'num_meetings': num_meetings
+            }
+
+        except Exception as e:
+            return {
+                'summary': f"Failed to analyze {num_meetings} meetings",
+                'feedback': f'Analysis failed: {str(e)}',
+                'error': str(e),
+                'date': batch['date'],
+                'num_meetings': num_meetings
+            }
+
     def format_report(self, analysis_result: Dict) -> str:
         """Format analysis results as a readable report"""
         report = []
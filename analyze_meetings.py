@@ -8,12 +8,18 @@ and sends a daily email summary.
 """
 
 import argparse
-import json
+import asyncio
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+import re
+import shutil
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, Iterable, Iterator, List
 from pathlib import Path
 
+import orjson
+
 from granola_client import GranolaClient
 from ai_analyzer import MeetingAnalyzer
 from email_sender import EmailSender
@@ -26,6 +32,44 @@ LOGS_DIR = str(SCRIPT_DIR / "logs")
 FEEDBACK_DIR = str(SCRIPT_DIR / "feedback")
 CURRENT_FEEDBACK_FILE = str(SCRIPT_DIR / "feedback" / "current.txt")
 
+# Recent feedback kept in one file (inside FEEDBACK_DIR) for the next run's context
+ROLLING_CONTEXT_NAME = "rolling_context.txt"
+ROLLING_CONTEXT_SEPARATOR = "\n\x1e\n"  # ASCII record separator, never appears in feedback
+ROLLING_CONTEXT_DAYS = 3
+
+# Transcript clean-up before analysis
+# A standalone filler (not part of "uh-huh" or "hmm's") and a following comma; before
+# end-of-sentence punctuation the space in front goes instead, so "It was um." -> "It was."
+_FILLER = r"(?<![-'\w])(?:u+m+|u+h+|uhm|erm|hmm+)(?![-'\w])"
+_FILLER_PATTERN = re.compile(rf"\s*{_FILLER}(?=[.!?])|{_FILLER},?\s*", re.IGNORECASE)
+_STUTTER_PATTERN = re.compile(r'\b([^\W\d_]+)(?:,?\s+\1\b){2,}', re.IGNORECASE)  # "I I I think" -> "I think"
+SHINGLE_SIZE = 5  # words per shingle for near-duplicate detection
+DUPLICATE_THRESHOLD = 0.9  # Jaccard similarity above which an utterance is dropped
+DUPLICATE_WINDOW = 10  # how many recent utterances to compare against
+
+
+def _write_file(path: str, data: str):
+    """Write a text file atomically via a temp file (runs on the runner's I/O pool)"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+
+
+def _write_feedback_files(feedback_file: str, current_file: str, feedback_text: str):
+    """Write the dated feedback once, then point current.txt at the same content"""
+    _write_file(feedback_file, feedback_text)
+
+    # Hard link instead of a second write, swapped in atomically so current.txt is never stale or partial
+    tmp_file = current_file + ".tmp"
+    if os.path.lexists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        os.link(feedback_file, tmp_file)
+    except OSError:
+        shutil.copyfile(feedback_file, tmp_file)  # filesystem without hard links
+    os.replace(tmp_file, current_file)
+
 
 class MeetingAnalysisRunner:
     """Main orchestrator for the meeting analysis workflow"""
@@ -35,13 +79,34 @@ class MeetingAnalysisRunner:
         self.analyzer = MeetingAnalyzer()
         self.email_sender = EmailSender()
         self.state = self._load_state()
+        # Set for O(1) lookups, written back as a sorted list by _save_state
+        self._processed = set(self.state.get("processed_documents", []))
+        # Report/feedback files are written in the background while the email goes out
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        self._pending_writes = []
+
+    def close(self):
+        """Wait for background writes, stop the I/O pool and close API connections"""
+        self._io_pool.shutdown(wait=True)
+        self.granola_client.close()
+
+    def _submit_write(self, path: str, data: str):
+        """Queue a file write on the I/O pool"""
+        self._pending_writes.append(self._io_pool.submit(_write_file, path, data))
+
+    def _flush_writes(self):
+        """Wait for queued writes, re-raising the first failure"""
+        pending, self._pending_writes = self._pending_writes, []
+        wait(pending)
+        for future in pending:
+            future.result()
 
     def _load_state(self) -> Dict:
         """Load analysis state from file"""
         if os.path.exists(STATE_FILE):
             try:
-                with open(STATE_FILE, 'r') as f:
-                    return json.load(f)
+                with open(STATE_FILE, 'rb') as f:
+                    return orjson.loads(f.read())
             except Exception as e:
                 print(f"Warning: Failed to load state file: {e}")
                 return {"processed_documents": []}
@@ -49,75 +114,120 @@ class MeetingAnalysisRunner:
 
     def _save_state(self):
         """Save analysis state to file"""
+        self.state["processed_documents"] = sorted(self._processed)
         try:
-            with open(STATE_FILE, 'w') as f:
-                json.dump(self.state, f, indent=2)
+            # Write to a temp file first so a crash mid-write can't corrupt the state
+            tmp_file = STATE_FILE + ".tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(self.state, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+            os.replace(tmp_file, STATE_FILE)
         except Exception as e:
             print(f"Warning: Failed to save state file: {e}")
 
     def _mark_as_processed(self, document_id: str):
-        """Mark a document as processed"""
-        if document_id not in self.state["processed_documents"]:
-            self.state["processed_documents"].append(document_id)
-            self._save_state()
+        """Mark a document as processed (persisted on the next _save_state)"""
+        self._processed.add(document_id)
 
     def _is_processed(self, document_id: str) -> bool:
         """Check if a document has been processed"""
-        return document_id in self.state.get("processed_documents", [])
+        return document_id in self._processed
 
-    def fetch_meetings(self, start_date: datetime, end_date: datetime, new_only: bool = False) -> List[Dict]:
-        """Fetch meetings from Granola API"""
+    def fetch_meetings(self, start_date: datetime, end_date: datetime, new_only: bool = False) -> Iterator[Dict]:
+        """Fetch meetings from Granola API as they arrive"""
         print(f"Fetching meetings from {start_date.date()} to {end_date.date()}...")
 
-        meetings = self.granola_client.get_meetings_in_date_range(start_date, end_date)
-
-        # Filter out already processed meetings if new_only flag is set
+        # With new_only, already-processed meetings and those waiting in a submitted batch
+        # are skipped before their transcripts are fetched
+        skip_ids = None
         if new_only:
-            original_count = len(meetings)
-            meetings = [m for m in meetings if not self._is_processed(m['id'])]
-            filtered_count = original_count - len(meetings)
-            if filtered_count > 0:
-                print(f"Filtered out {filtered_count} already-processed meetings")
-
-        print(f"Found {len(meetings)} meetings to analyze")
-        return meetings
+            skip_ids = self._processed.union(
+                *(batch.get('meeting_ids', []) for batch in self.state.get("pending_batches", []))
+            )
+        return self.granola_client.iter_meetings_in_date_range(start_date, end_date, skip_ids=skip_ids)
 
-    def prepare_meetings_for_analysis(self, meetings: List[Dict]) -> List[Dict]:
+    def prepare_meetings_for_analysis(self, meetings: Iterable[Dict]) -> List[Dict]:
         """Prepare meetings by formatting transcripts"""
         prepared = []
         for meeting in meetings:
+            # Only the formatted text is needed from here on, so drop the raw utterances
             transcript_text = self.granola_client.format_transcript_text(
-                meeting.get('transcript', [])
+                meeting.pop('transcript', [])
             )
-            meeting['transcript_text'] = transcript_text
+            meeting['transcript_text'] = self._compress_transcript(transcript_text)
             prepared.append(meeting)
         return prepared
 
+    def _compress_transcript(self, text: str) -> str:
+        """Shrink a formatted transcript before it is sent for analysis
+
+        Drops filler words, stutters and near-duplicate utterances (e.g. the same
+        speech picked up by both microphone and system audio), then merges
+        consecutive lines from the same speaker.
+        """
+        kept = []  # [speaker, text] pairs
+        recent = []  # shingle sets of the last few kept utterances
+
+        for line in text.split('\n'):
+            speaker, sep, utterance = line.partition(': ')
+            if not sep:
+                speaker, utterance = None, line
+
+            utterance = _STUTTER_PATTERN.sub(r'\1', _FILLER_PATTERN.sub('', utterance)).strip()
+            if not utterance:
+                continue
+
+            # Utterances shorter than one shingle ("Yeah.") are never treated as duplicates
+            words = utterance.lower().split()
+            shingles = {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+            if shingles:
+                if any(len(shingles & prev) / len(shingles | prev) > DUPLICATE_THRESHOLD for prev in recent):
+                    continue
+                recent.append(shingles)
+                del recent[:-DUPLICATE_WINDOW]
+
+            if kept and (speaker is None or kept[-1][0] == speaker):
+                kept[-1][1] += ' ' + utterance
+            else:
+                kept.append([speaker, utterance])
+
+        return '\n'.join(f"{speaker}: {utterance}" if speaker is not None else utterance
+                         for speaker, utterance in kept)
+
     def _load_previous_feedback(self) -> Optional[str]:
         """Load previous week's feedback for context"""
         try:
-            # Get all feedback files from the past 7 days
-            feedback_files = []
-            if Path(FEEDBACK_DIR).exists():
-                for f in Path(FEEDBACK_DIR).glob("feedback_*.txt"):
-                    # Extract date from filename (format: feedback_YYYYMMDD.txt)
-                    try:
-                        date_str = f.stem.split('_')[1]
-                        file_date = datetime.strptime(date_str, "%Y%m%d")
-                        days_ago = (datetime.now() - file_date).days
-                        if 1 <= days_ago <= 7:  # Past week, excluding today
-                            feedback_files.append((file_date, f))
-                    except:
-                        continue
-
-            if not feedback_files:
+            self._flush_writes()
+
+            # Get all feedback from the past 7 days
+            recent_feedback = []
+            today_ord = datetime.now().toordinal()
+            rolling_file = Path(FEEDBACK_DIR) / ROLLING_CONTEXT_NAME
+            if rolling_file.exists():
+                # Fast path: the last few days are kept together in one file
+                for file_date, text in self._read_rolling_context(rolling_file):
+                    days_ago = today_ord - file_date.toordinal()
+                    if 1 <= days_ago <= 7:  # Past week, excluding today
+                        recent_feedback.append((file_date, text))
+            else:
+                feedback_files = []
+                for file_date, path in self._scan_feedback_files():
+                    days_ago = today_ord - file_date.toordinal()
+                    if 1 <= days_ago <= 7:  # Past week, excluding today
+                        feedback_files.append((file_date, path))
+
+                feedback_files.sort(reverse=True)
+                for file_date, file in feedback_files[:ROLLING_CONTEXT_DAYS]:
+                    with open(file) as fh:
+                        recent_feedback.append((file_date, fh.read()))
+
+            if not recent_feedback:
                 return None
 
             # Sort by date and get recent feedback
-            feedback_files.sort(reverse=True)
+            recent_feedback.sort(reverse=True)
             combined_feedback = "\n\n".join([
-                f"[{date.strftime('%Y-%m-%d')}]\n{open(file).read()}"
-                for date, file in feedback_files[:3]  # Last 3 days of feedback
+                f"[{date.strftime('%Y-%m-%d')}]\n{text}"
+                for date, text in recent_feedback[:ROLLING_CONTEXT_DAYS]  # Last 3 days of feedback
             ])
 
             return combined_feedback if combined_feedback else None
@@ -126,12 +236,73 @@ class MeetingAnalysisRunner:
             print(f"Warning: Could not load previous feedback: {e}")
             return None
 
-    def _save_feedback(self, feedback_text: str):
-        """Save feedback with versioning"""
+    def _scan_feedback_files(self) -> List[tuple]:
+        """List the dated feedback files (including backups) as (date, path) pairs"""
+        if not Path(FEEDBACK_DIR).exists():
+            return []
+
+        feedback_files = []
+        with os.scandir(FEEDBACK_DIR) as entries:
+            for entry in entries:
+                name = entry.name
+                if not (name.startswith("feedback_") and name.endswith(".txt")):
+                    continue
+                # Extract date from filename (format: feedback_YYYYMMDD[...].txt)
+                try:
+                    date_str = name[9:17]
+                    file_date = date(int(date_str[0:4]), int(date_str[4:6]), int(date_str[6:8]))
+                except ValueError:
+                    continue
+                feedback_files.append((file_date, entry.path))
+        return feedback_files
+
+    def _read_rolling_context(self, rolling_file: Path) -> List[tuple]:
+        """Parse the rolling context file into (date, feedback) pairs"""
+        entries = []
+        for entry in rolling_file.read_text().split(ROLLING_CONTEXT_SEPARATOR):
+            header, _, text = entry.partition('\n')
+            try:
+                entries.append((date.fromisoformat(header.strip('[]')), text))
+            except ValueError:
+                continue
+        return entries
+
+    def _update_rolling_context(self, feedback_text: str, feedback_date: datetime):
+        """Add this run's feedback to the rolling context, keeping only the last few days"""
+        rolling_file = Path(FEEDBACK_DIR) / ROLLING_CONTEXT_NAME
+        day = feedback_date.date()
+
+        if rolling_file.exists():
+            entries = self._read_rolling_context(rolling_file)
+        else:
+            # First save since upgrading: seed from the dated files the slow path would have read
+            dated_files = sorted(
+                (d, path) for d, path in self._scan_feedback_files()
+                if d != day and os.path.basename(path) == f"feedback_{d.strftime('%Y%m%d')}.txt"
+            )
+            entries = []
+            for d, path in dated_files[-ROLLING_CONTEXT_DAYS:]:
+                with open(path) as fh:
+                    entries.append((d, fh.read()))
+        entries = [(d, text) for d, text in entries if d != day]  # re-runs replace the day's entry
+        entries.append((day, feedback_text))
+        entries.sort()
+
+        # One extra entry so a same-day re-run (which skips today) still sees 3 previous days
+        entries = entries[-(ROLLING_CONTEXT_DAYS + 1):]
+
+        _write_file(str(rolling_file), ROLLING_CONTEXT_SEPARATOR.join(
+            f"[{d.strftime('%Y-%m-%d')}]\n{text}" for d, text in entries
+        ))
+
+    def _save_feedback(self, feedback_text: str, feedback_date: Optional[datetime] = None):
+        """Save feedback with versioning (written in the background, see _flush_writes)"""
+        # Earlier writes must land before we look for a file to back up
+        self._flush_writes()
         Path(FEEDBACK_DIR).mkdir(exist_ok=True)
 
         # Create dated feedback file
-        today = datetime.now().strftime("%Y%m%d")
+        today = (feedback_date or datetime.now()).strftime("%Y%m%d")
         feedback_file = f"{FEEDBACK_DIR}/feedback_{today}.txt"
 
         # If file exists, back it up
@@ -140,17 +311,20 @@ class MeetingAnalysisRunner:
             Path(feedback_file).rename(backup_file)
             print(f"✓ Previous feedback backed up to: {backup_file}")
 
-        # Save new feedback
-        with open(feedback_file, 'w') as f:
-            f.write(feedback_text)
+        # Save new feedback, also as "current" for easy access
+        self._pending_writes.append(
+            self._io_pool.submit(_write_feedback_files, feedback_file, CURRENT_FEEDBACK_FILE, feedback_text)
+        )
 
-        # Also save as "current" for easy access
-        with open(CURRENT_FEEDBACK_FILE, 'w') as f:
-            f.write(feedback_text)
+        # Keep the next run's previous-feedback context up to date
+        self._pending_writes.append(
+            self._io_pool.submit(self._update_rolling_context, feedback_text, feedback_date or datetime.now())
+        )
 
         print(f"✓ Feedback saved to: {feedback_file}")
 
-    def analyze_and_report(self, meetings: List[Dict], date_range_str: str, send_email: bool = True) -> str:
+    def analyze_and_report(self, meetings: List[Dict], date_range_str: str, send_email: bool = True,
+                           use_batch: bool = False) -> str:
         """Analyze meetings and generate report"""
         if not meetings:
             print("No meetings to analyze")
@@ -161,14 +335,75 @@ class MeetingAnalysisRunner:
         if previous_feedback:
             print("✓ Loaded previous week's feedback for context")
 
+        if use_batch:
+            print(f"Submitting {len(meetings)} meetings to the OpenAI Batch API...")
+            try:
+                batch = self.analyzer.submit_batch(meetings, previous_feedback=previous_feedback)
+            except ValueError as e:
+                print(f"Warning: {e}. Analyzing now instead.")
+            else:
+                batch['date_range'] = date_range_str
+                self.state.setdefault("pending_batches", []).append(batch)
+                self._save_state()
+                print(f"✓ Submitted batch {batch['batch_id']}. Run collect_batches.py to deliver the report.")
+                return f"Analysis submitted as batch {batch['batch_id']}"
+
         print(f"Analyzing {len(meetings)} meetings with GPT-4o...")
         analysis_result = self.analyzer.analyze_meetings(meetings, previous_feedback=previous_feedback)
 
+        return self._publish_analysis(analysis_result, date_range_str, [m['id'] for m in meetings], send_email)
+
+    def collect_batches(self, send_email: bool = True) -> int:
+        """Deliver reports for finished batches, returns how many are still pending"""
+        pending = self.state.get("pending_batches", [])
+        if not pending:
+            print("No pending batches")
+            return 0
+
+        still_pending = []
+        for index, batch in enumerate(pending):
+            try:
+                analysis_result = self.analyzer.collect_batch(batch)
+            except Exception as e:
+                print(f"Warning: Could not check batch {batch['batch_id']}: {e}")
+                still_pending.append(batch)
+                continue
+            if analysis_result is None:
+                print(f"Batch {batch['batch_id']} is still running")
+                still_pending.append(batch)
+                continue
+
+            # Expired or failed batches are dropped without saving feedback or marking
+            # their meetings processed, so the next run analyzes them again
+            if analysis_result.get('error'):
+                print(f"Warning: Batch {batch['batch_id']} did not complete ({analysis_result['error']}). "
+                      "Its meetings will be analyzed again on the next run.")
+                continue
+
+            print(f"✓ Batch {batch['batch_id']} finished")
+            # Saved together with the processed ids, so a crash later in the loop
+            # can't publish this batch a second time
+            self.state["pending_batches"] = still_pending + pending[index + 1:]
+            self._publish_analysis(
+                analysis_result,
+                batch.get('date_range', batch['date']),
+                batch.get('meeting_ids', []),
+                send_email,
+                feedback_date=datetime.strptime(batch['date'], "%Y-%m-%d")
+            )
+
+        self.state["pending_batches"] = still_pending
+        self._save_state()
+        return len(still_pending)
+
+    def _publish_analysis(self, analysis_result: Dict, date_range_str: str, meeting_ids: List[str],
+                          send_email: bool = True, feedback_date: Optional[datetime] = None) -> str:
+        """Save, print and email an analysis result, then mark its meetings as processed"""
         # Format report
         report = self.analyzer.format_report(analysis_result)
 
         # Save to feedback directory
-        self._save_feedback(analysis_result.get('feedback', ''))
+        self._save_feedback(analysis_result.get('feedback', ''), feedback_date=feedback_date)
 
         # Save to logs directory
         self._save_report_to_log(report, date_range_str, analysis_result)
@@ -179,18 +414,33 @@ class MeetingAnalysisRunner:
         # Send email if requested
         if send_email:
             print("\nSending email report...")
-            success = self.email_sender.send_analysis_report(report, date_range_str)
+            success = asyncio.run(self._send_email_while_writing(report, date_range_str))
             if success:
                 print("Email sent successfully!")
             else:
                 print("Failed to send email. Report saved to feedback and logs directory.")
 
+        # Feedback and logs must be on disk before the meetings count as processed
+        self._flush_writes()
+
         # Mark all meetings as processed
-        for meeting in meetings:
-            self._mark_as_processed(meeting['id'])
+        self._processed.update(meeting_ids)
+        self._save_state()
 
         return report
 
+    async def _send_email_while_writing(self, report: str, date_range_str: str) -> bool:
+        """Send the report email while the queued feedback/log writes finish"""
+        try:
+            results = await asyncio.gather(
+                self.email_sender.send_analysis_report_async(report, date_range_str),
+                *[asyncio.wrap_future(future) for future in self._pending_writes],
+                return_exceptions=True  # write errors are re-raised by _flush_writes
+            )
+        finally:
+            await self.email_sender.aclose()
+        return results[0] is True
+
     def _save_report_to_log(self, report_text: str, date_range_str: str, analysis_result: Dict):
         """Save analysis report to logs directory"""
         # Create logs directory if it doesn't exist
@@ -202,13 +452,11 @@ class MeetingAnalysisRunner:
 
         # Save text report
         text_filename = f"{LOGS_DIR}/analysis_{timestamp}_{safe_date_range}.txt"
-        with open(text_filename, 'w') as f:
-            f.write(report_text)
+        self._submit_write(text_filename, report_text)
 
         # Save JSON data for potential later processing
         json_filename = f"{LOGS_DIR}/analysis_{timestamp}_{safe_date_range}.json"
-        with open(json_filename, 'w') as f:
-            json.dump(analysis_result, f, indent=2)
+        self._submit_write(json_filename, orjson.dumps(analysis_result, option=orjson.OPT_INDENT_2).decode())
 
         print(f"\n✓ Report saved to: {text_filename}")
         print(f"✓ JSON data saved to: {json_filename}")
@@ -237,29 +485,32 @@ class MeetingAnalysisRunner:
         print("-" * 80)
 
         try:
-            # Fetch meetings
-            meetings = self.fetch_meetings(start_date, end_date, new_only=args.new_only)
+            # Fetch meetings, formatting each transcript as it arrives
+            prepared_meetings = self.prepare_meetings_for_analysis(
+                self.fetch_meetings(start_date, end_date, new_only=args.new_only)
+            )
+            print(f"Found {len(prepared_meetings)} meetings to analyze")
 
-            if not meetings:
+            if not prepared_meetings:
                 print("No meetings found. Nothing to analyze.")
                 return
 
-            # Prepare meetings
-            prepared_meetings = self.prepare_meetings_for_analysis(meetings)
-
             # Analyze and report
             self.analyze_and_report(
                 prepared_meetings,
                 date_range_str,
-                send_email=not args.no_email
+                send_email=not args.no_email,
+                use_batch=args.batch
             )
 
         except Exception as e:
             print(f"Error during analysis: {e}")
-            import traceback
             traceback.print_exc()
             return
 
+        finally:
+            self.close()
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -298,6 +549,12 @@ def main():
         help="Don't send email, just print to console"
     )
 
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit through the OpenAI Batch API (cheaper, delivered later by collect_batches.py)"
+    )
+
     parser.add_argument(
         "--test-email",
         action="store_true",
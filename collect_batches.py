@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Batch Collector
+
+Polls OpenAI for analyses submitted with `analyze_meetings.py --batch`
+and delivers the finished reports (feedback, logs and email).
+Meant to run from cron every hour or so.
+"""
+
+import argparse
+
+from analyze_meetings import MeetingAnalysisRunner
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Deliver meeting analyses submitted through the OpenAI Batch API"
+    )
+
+    parser.add_argument(
+        "--no-email",
+        action="store_true",
+        help="Don't send email, just print to console"
+    )
+
+    args = parser.parse_args()
+
+    runner = MeetingAnalysisRunner()
+    try:
+        remaining = runner.collect_batches(send_email=not args.no_email)
+    finally:
+        runner.close()
+    if remaining:
+        print(f"{remaining} batch(es) still pending")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,69 @@
 Email sender using Resend API for daily meeting analysis reports.
 """
 
+import html
 import os
+import re
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
+import httpx
 import resend
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+# Report line kinds, tried in order against the stripped line
+_LINE_PATTERN = re.compile(
+    r'(?P<hr2>.*={40})'
+    r'|(?P<hr1>.*-{40})'
+    r'|(?P<h2>TOP 3 STRENGTHS|TOP 3 AREAS|OVERALL ASSESSMENT)'
+    r'|(?P<h3>Meeting: )'
+    r'|(?P<h1>SR\. STAFF LEVEL|INDIVIDUAL MEETING)'
+    r'|(?P<li>[123]\.|-)'
+)
+
+_LINE_TEMPLATES = {
+    'hr2': '<hr style="border: 2px solid #333; margin: 20px 0;">',
+    'hr1': '<hr style="border: 1px solid #666; margin: 15px 0;">',
+    'h2': '<h2 style="color: #2563eb; margin-top: 20px;">{}</h2>',
+    'h3': '<h3 style="color: #1e40af; margin-top: 15px;">{}</h3>',
+    'h1': '<h1 style="color: #1e3a8a;">{}</h1>',
+    'li': '<p style="margin-left: 20px; line-height: 1.6;">{}</p>',
+    'p': '<p style="line-height: 1.6;">{}</p>',
+}
+
+_BLANK_LINE_HTML = '<br>'
+
+# Page around the formatted report, {body} marks where it goes
+_HTML_SHELL = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Meeting Analysis Report</title>
+</head>
+<body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+             max-width: 800px; margin: 0 auto; padding: 20px; background-color: #f9fafb; color: #111827;">
+    <div style="background-color: white; padding: 30px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1);">
+        {body}
+    </div>
+    <div style="text-align: center; margin-top: 20px; color: #6b7280; font-size: 12px;">
+        <p>This report was generated automatically by your Granola Meeting Analyzer</p>
+    </div>
+</body>
+</html>
+        """
+# Split once at import so each email is a plain concatenation
+_HTML_HEAD, _HTML_TAIL = _HTML_SHELL.split("{body}")
+
+
 class EmailSender:
     """Sends meeting analysis reports via Resend"""
 
+    RESEND_API_URL = "https://api.resend.com/emails"
+
     def __init__(self, api_key: str = None, from_email: str = None, recipient_email: str = None):
         """Initialize email sender with Resend API"""
         self.api_key = api_key or os.getenv('RESEND_API_KEY')
@@ -30,8 +81,11 @@ class EmailSender:
         if not self.recipient_email:
             raise ValueError("RECIPIENT_EMAIL not provided. Set RECIPIENT_EMAIL in .env file")
 
-    def send_analysis_report(self, report_text: str, date_range: str = None) -> bool:
-        """Send meeting analysis report via email"""
+        # Shared by async sends in one event loop, closed by aclose()
+        self._httpx = None
+
+    def _build_report_params(self, report_text: str, date_range: str = None) -> Dict:
+        """Build the Resend email payload for a report"""
         # Create subject line
         if date_range:
             subject = f"Sr. Staff Meeting Analysis - {date_range}"
@@ -41,14 +95,22 @@ class EmailSender:
         # Convert plain text report to HTML for better formatting
         html_content = self._format_html_email(report_text)
 
+        return {
+            "from": self.from_email,
+            "to": [self.recipient_email],
+            "subject": subject,
+            "html": html_content,
+            "text": report_text  # Fallback plain text
+        }
+
+    def send_analysis_report(self, report_text: str, date_range: str = None) -> bool:
+        """Send meeting analysis report via email
+
+        Blocking send through the resend SDK for callers without an event loop;
+        the runner uses send_analysis_report_async.
+        """
         try:
-            params = {
-                "from": self.from_email,
-                "to": [self.recipient_email],
-                "subject": subject,
-                "html": html_content,
-                "text": report_text  # Fallback plain text
-            }
+            params = self._build_report_params(report_text, date_range)
 
             email = resend.Emails.send(params)
             print(f"Email sent successfully! ID: {email.get('id', 'unknown')}")
@@ -58,58 +120,56 @@ class EmailSender:
             print(f"Failed to send email: {e}")
             return False
 
+    async def send_analysis_report_async(self, report_text: str, date_range: str = None) -> bool:
+        """Send meeting analysis report via Resend's HTTP API without blocking the event loop"""
+        try:
+            params = self._build_report_params(report_text, date_range)
+
+            if self._httpx is None:
+                self._httpx = httpx.AsyncClient(timeout=30)
+            response = await self._httpx.post(
+                self.RESEND_API_URL,
+                json=params,
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            response.raise_for_status()
+            print(f"Email sent successfully! ID: {response.json().get('id', 'unknown')}")
+            return True
+
+        except Exception as e:
+            print(f"Failed to send email: {e}")
+            return False
+
+    async def aclose(self):
+        """Close the async HTTP client (it is tied to the event loop that created it)"""
+        if self._httpx is not None:
+            await self._httpx.aclose()
+            self._httpx = None
+
     def _format_html_email(self, report_text: str) -> str:
         """Convert plain text report to HTML with formatting"""
-        # Escape HTML and preserve line breaks
-        import html
-        escaped_text = html.escape(report_text)
-
         # Convert to HTML with basic formatting
         html_lines = []
-        in_section = False
-
-        for line in escaped_text.split('\n'):
-            if '=' * 40 in line:
-                html_lines.append('<hr style="border: 2px solid #333; margin: 20px 0;">')
-            elif '-' * 40 in line:
-                html_lines.append('<hr style="border: 1px solid #666; margin: 15px 0;">')
-            elif line.strip().startswith('TOP 3 STRENGTHS') or line.strip().startswith('TOP 3 AREAS') or line.strip().startswith('OVERALL ASSESSMENT'):
-                html_lines.append(f'<h2 style="color: #2563eb; margin-top: 20px;">{line.strip()}</h2>')
-            elif line.strip().startswith('Meeting: '):
-                html_lines.append(f'<h3 style="color: #1e40af; margin-top: 15px;">{line.strip()}</h3>')
-            elif line.strip().startswith('SR. STAFF LEVEL') or line.strip().startswith('INDIVIDUAL MEETING'):
-                html_lines.append(f'<h1 style="color: #1e3a8a;">{line.strip()}</h1>')
-            elif line.strip().startswith(('1.', '2.', '3.', '-')):
-                html_lines.append(f'<p style="margin-left: 20px; line-height: 1.6;">{line.strip()}</p>')
-            elif line.strip():
-                html_lines.append(f'<p style="line-height: 1.6;">{line.strip()}</p>')
-            else:
-                html_lines.append('<br>')
+
+        # Bound once outside the loop, it runs for every report line
+        append = html_lines.append
+        escape = html.escape
+
+        # Single pass: escape each line as it is formatted (the patterns contain no
+        # characters html.escape changes, so matching before escaping is equivalent)
+        for line in report_text.split('\n'):
+            stripped = line.strip()
+            if not stripped:
+                append(_BLANK_LINE_HTML)
+                continue
+
+            match = _LINE_PATTERN.match(stripped)
+            append(_LINE_TEMPLATES[match.lastgroup if match else 'p'].format(escape(stripped)))
 
         html_body = '\n'.join(html_lines)
 
         # Wrap in full HTML template
-        html_template = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Meeting Analysis Report</title>
-</head>
-<body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-             max-width: 800px; margin: 0 auto; padding: 20px; background-color: #f9fafb; color: #111827;">
-    <div style="background-color: white; padding: 30px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1);">
-        {html_body}
-    </div>
-    <div style="text-align: center; margin-top: 20px; color: #6b7280; font-size: 12px;">
-        <p>This report was generated automatically by your Granola Meeting Analyzer</p>
-    </div>
-</body>
-</html>
-        """
-
-        return html_template
+        return _HTML_HEAD + html_body + _HTML_TAIL
 
     def send_test_email(self) -> bool:
         """Send a test email to verify configuration"""
@@ -3,11 +3,32 @@ Granola API Client for fetching meeting transcriptions.
 Uses reverse-engineered API endpoints.
 """
 
-import json
+import base64
 import os
+import shutil
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import orjson
 import requests
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Dict, Optional, Set, Tuple
+
+# Python 3.11+ parses a trailing 'Z' itself; older versions need it spelled as an offset
+if sys.version_info >= (3, 11):
+    _FROMISO = datetime.fromisoformat
+else:
+    def _FROMISO(value: str) -> datetime:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        return datetime.fromisoformat(value)
 
 
 class GranolaClient:
@@ -16,23 +37,80 @@ class GranolaClient:
     CREDENTIALS_PATH = os.path.expanduser("~/Library/Application Support/Granola/supabase.json")
     API_BASE = "https://api.granola.ai"
     WORKOS_AUTH_URL = "https://api.workos.com/user_management/authenticate"
+    TRANSCRIPT_CACHE_DIR = os.path.expanduser("~/.cache/granola-coach/transcripts")
+    TOKEN_REFRESH_MARGIN = timedelta(seconds=60)  # refresh this long before the access token expires
+    TRANSCRIPT_CONCURRENCY = 16  # parallel transcript fetches
+    PAGE_PREFETCH = 4  # document pages kept in flight once there is more than one
+    TRANSCRIPT_WINDOW = 32  # fetched transcripts allowed to wait on a slow consumer
+    RETRY_TOTAL = 5  # retries for rate-limited or failing API calls
+    RETRY_BACKOFF = 0.5  # seconds, doubled on each retry
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
 
     def __init__(self):
         self.access_token = None
         self.refresh_token = None
         self.client_id = None
+        self._access_expiry = None
+        self._creds = None  # parsed credentials file, reused when saving refreshed tokens
+        self._creds_mtime = None
+        # Refresh tokens are one-time use, so only one thread may refresh at a time
+        self._auth_lock = threading.Lock()
         self._load_credentials()
 
+        # One pooled session so repeated calls reuse the TCP+TLS connection
+        self.session = requests.Session()
+        # api.granola.ai is the only host through this adapter; keep a connection per worker
+        # thread so none are opened (and re-resolved) mid-run once the pool is warm.
+        # Its endpoints are all read-only POSTs, so they are safe to retry. Back off
+        # exponentially on rate limits and server errors, honouring Retry-After
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.TRANSCRIPT_CONCURRENCY + self.PAGE_PREFETCH,
+            max_retries=Retry(
+                total=self.RETRY_TOTAL,
+                backoff_factor=self.RETRY_BACKOFF,
+                status_forcelist=self.RETRY_STATUSES,
+                allowed_methods=frozenset(["GET", "POST"]),
+                respect_retry_after_header=True
+            )
+        ))
+        # A token refresh spends the one-time refresh token, so never replay it. Refreshes
+        # are serialized by the auth lock, so one connection is enough
+        self.session.mount(self.WORKOS_AUTH_URL, HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "Granola/5.354.0",
+            "X-Client-Version": "5.354.0"
+        }
+        self.session.headers.update(headers)
+        self.session.headers["Authorization"] = f"Bearer {self.access_token}"
+
+        # Transcripts go over HTTP/2, so all the concurrent fetches share one multiplexed
+        # connection instead of a pooled connection per worker thread
+        self._transcript_client = httpx.Client(
+            http2=True,
+            headers=headers,
+            timeout=httpx.Timeout(30.0),
+            transport=httpx.HTTPTransport(http2=True, retries=self.RETRY_TOTAL)
+        )
+
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self.session.close()
+        self._transcript_client.close()
+
     def _load_credentials(self):
         """Load credentials from Granola's local storage"""
         try:
-            with open(self.CREDENTIALS_PATH, 'r') as f:
-                creds = json.load(f)
+            with open(self.CREDENTIALS_PATH, 'rb') as f:
+                creds = orjson.loads(f.read())
+                self._creds = creds
+                self._creds_mtime = self._credentials_mtime()
 
                 # Extract tokens from supabase.json structure
                 # Try workos_tokens format (current Granola format)
                 if 'workos_tokens' in creds:
-                    workos_tokens = json.loads(creds['workos_tokens'])
+                    workos_tokens = orjson.loads(creds['workos_tokens'])
                     self.access_token = workos_tokens.get('access_token')
                     self.refresh_token = workos_tokens.get('refresh_token')
                 # Try currentSession format (older format)
@@ -46,13 +124,35 @@ class GranolaClient:
                     self.refresh_token = creds.get('refresh_token')
 
                 self.client_id = creds.get('client_id', 'client_01JARHTH2HQ6D64XDAEVXFNQ44')
+                self._access_expiry = self._token_expiry(self.access_token)
 
         except FileNotFoundError:
             raise Exception(f"Granola credentials not found at {self.CREDENTIALS_PATH}. "
                           "Please make sure Granola app is installed and you're logged in.")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise Exception("Failed to parse Granola credentials file.")
 
+    @staticmethod
+    def _token_expiry(token: Optional[str]) -> Optional[datetime]:
+        """Read the exp claim of a JWT access token, None if it can't be read"""
+        try:
+            claims = token.split('.')[1]
+            claims = orjson.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)))
+            return datetime.fromtimestamp(claims['exp'], tz=timezone.utc)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError, OverflowError):
+            return None
+
+    def _ensure_fresh_token(self):
+        """Refresh up front if the access token is expired or about to be"""
+        expiry = self._access_expiry
+        if expiry is None or expiry - datetime.now(timezone.utc) > self.TOKEN_REFRESH_MARGIN:
+            return
+
+        with self._auth_lock:
+            # Another thread may already have refreshed
+            if self._access_expiry == expiry:
+                self._refresh_access_token()
+
     def _refresh_access_token(self):
         """Refresh the access token using WorkOS"""
         if not self.refresh_token:
@@ -65,32 +165,47 @@ class GranolaClient:
         }
 
         try:
-            response = requests.post(self.WORKOS_AUTH_URL, json=payload)
+            # Don't send the (expired) Granola token to WorkOS
+            response = self.session.post(
+                self.WORKOS_AUTH_URL, data=orjson.dumps(payload), headers={"Authorization": None}
+            )
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
 
             # Update tokens (refresh tokens are one-time use)
             self.access_token = data['access_token']
             self.refresh_token = data['refresh_token']
+            self._access_expiry = self._token_expiry(self.access_token)
+            self.session.headers["Authorization"] = f"Bearer {self.access_token}"
 
             # Save updated refresh token for next time
             self._save_refresh_token()
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             raise Exception(f"Failed to refresh access token: {e}")
 
+    def _credentials_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.CREDENTIALS_PATH)
+        except OSError:
+            return None
+
     def _save_refresh_token(self):
         """Save updated refresh token back to credentials file"""
         try:
-            with open(self.CREDENTIALS_PATH, 'r') as f:
-                creds = json.load(f)
+            creds = self._creds
+            # Granola may have rewritten the file since we loaded it, don't clobber its changes
+            if creds is None or self._credentials_mtime() != self._creds_mtime:
+                with open(self.CREDENTIALS_PATH, 'rb') as f:
+                    creds = orjson.loads(f.read())
 
             # Save in the same format we found it
             if 'workos_tokens' in creds:
-                workos_tokens = json.loads(creds['workos_tokens'])
+                workos_tokens = orjson.loads(creds['workos_tokens'])
                 workos_tokens['access_token'] = self.access_token
                 workos_tokens['refresh_token'] = self.refresh_token
-                creds['workos_tokens'] = json.dumps(workos_tokens)
+                # Granola stores the nested tokens as a minified JSON string
+                creds['workos_tokens'] = orjson.dumps(workos_tokens).decode()
             elif 'currentSession' in creds:
                 creds['currentSession']['access_token'] = self.access_token
                 creds['currentSession']['refresh_token'] = self.refresh_token
@@ -98,36 +213,68 @@ class GranolaClient:
                 creds['access_token'] = self.access_token
                 creds['refresh_token'] = self.refresh_token
 
-            with open(self.CREDENTIALS_PATH, 'w') as f:
-                json.dump(creds, f, indent=2)
+            # Write atomically so a crash can't leave Granola with a truncated file
+            tmp_path = f"{self.CREDENTIALS_PATH}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(creds, option=orjson.OPT_INDENT_2))
+            shutil.copymode(self.CREDENTIALS_PATH, tmp_path)
+            os.replace(tmp_path, self.CREDENTIALS_PATH)
+
+            self._creds = creds
+            self._creds_mtime = self._credentials_mtime()
 
         except Exception as e:
             print(f"Warning: Failed to save updated refresh token: {e}")
 
-    def _make_request(self, endpoint: str, payload: dict, retry_auth: bool = True) -> dict:
-        """Make authenticated request to Granola API"""
+    def _make_request(self, endpoint: str, payload: dict, retry_auth: bool = True, http2: bool = False) -> dict:
+        """Make authenticated request to Granola API, over the HTTP/2 client if http2 is set"""
         url = f"{self.API_BASE}{endpoint}"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json",
-            "User-Agent": "Granola/5.354.0",
-            "X-Client-Version": "5.354.0"
-        }
+        # Avoid a guaranteed 401 round trip when the saved token has already expired
+        self._ensure_fresh_token()
 
-        try:
-            response = requests.post(url, json=payload, headers=headers)
+        body = orjson.dumps(payload)
 
-            # If unauthorized and we haven't retried yet, refresh token and retry
-            if response.status_code == 401 and retry_auth:
-                self._refresh_access_token()
-                return self._make_request(endpoint, payload, retry_auth=False)
+        try:
+            for attempt in (0, 1):
+                sent_token = self.access_token
+                if http2:
+                    response = self._post_http2(url, body)
+                else:
+                    response = self.session.post(url, data=body)
+
+                # Only an unauthorized first attempt gets a token refresh and a retry
+                if response.status_code != 401 or attempt == 1 or not retry_auth:
+                    break
+                with self._auth_lock:
+                    # Another thread may already have refreshed while this request was in flight
+                    if self.access_token == sent_token:
+                        self._refresh_access_token()
 
             response.raise_for_status()
-            return response.json()
+            # Parse the raw bytes: JSON is UTF-8, so requests' charset detection and str
+            # decode are skipped. gzip is already negotiated by requests' default headers
+            return orjson.loads(response.content)
 
-        except requests.exceptions.RequestException as e:
+        # A body that isn't JSON is reported like any other failed request
+        except (requests.exceptions.RequestException, httpx.HTTPError, orjson.JSONDecodeError) as e:
             raise Exception(f"API request failed: {e}")
 
+    def _post_http2(self, url: str, body: bytes) -> httpx.Response:
+        """POST through the HTTP/2 client, backing off on the same statuses as the session"""
+        for attempt in range(self.RETRY_TOTAL + 1):
+            response = self._transcript_client.post(
+                url, content=body, headers={"Authorization": f"Bearer {self.access_token}"}
+            )
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.RETRY_TOTAL:
+                return response
+
+            try:
+                delay = float(response.headers["Retry-After"])
+            except (KeyError, ValueError):
+                delay = self.RETRY_BACKOFF * 2 ** attempt
+            time.sleep(delay)
+        return response
+
     def get_documents(self, limit: int = 100, offset: int = 0) -> List[Dict]:
         """Fetch documents from Granola"""
         payload = {
@@ -139,66 +286,172 @@ class GranolaClient:
         response = self._make_request("/v2/get-documents", payload)
         return response.get('docs', [])
 
-    def get_document_transcript(self, document_id: str) -> List[Dict]:
-        """Fetch raw transcript for a specific document"""
+    def get_document_transcript(self, document_id: str, updated_at: Optional[str] = None) -> List[Dict]:
+        """Fetch raw transcript for a specific document
+
+        When the document's updated_at is known, the transcript is cached on
+        disk and reused until the document changes.
+        """
+        if updated_at:
+            cached = self._load_cached_transcript(document_id, updated_at)
+            if cached is not None:
+                return cached
+
         payload = {"document_id": document_id}
 
-        response = self._make_request("/v1/get-document-transcript", payload)
+        response = self._make_request("/v1/get-document-transcript", payload, http2=True)
         # API returns a list directly, not a dict with 'utterances'
-        return response if isinstance(response, list) else []
+        transcript = response if isinstance(response, list) else []
+
+        # Empty transcripts may still be processing, so only cache real ones
+        if updated_at and transcript:
+            self._save_cached_transcript(document_id, transcript)
+        return transcript
 
-    def get_meetings_in_date_range(self, start_date: datetime, end_date: datetime) -> List[Dict]:
-        """Fetch all meetings within a date range"""
-        from datetime import timezone
+    def _transcript_cache_path(self, document_id: str) -> str:
+        return os.path.join(self.TRANSCRIPT_CACHE_DIR, f"{document_id}.json")
 
+    def _load_cached_transcript(self, document_id: str, updated_at: str) -> Optional[List[Dict]]:
+        """Return the cached transcript if it was written after the document's last update"""
+        path = self._transcript_cache_path(document_id)
+        try:
+            if os.path.getmtime(path) < _FROMISO(updated_at).timestamp():
+                return None
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _save_cached_transcript(self, document_id: str, transcript: List[Dict]):
+        """Write the transcript cache file atomically, readable only by this user"""
+        path = self._transcript_cache_path(document_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.TRANSCRIPT_CACHE_DIR, mode=0o700, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(transcript))
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache transcript {document_id}: {e}")
+
+    def get_meetings_in_date_range(self, start_date: datetime, end_date: datetime,
+                                   skip_ids: Optional[Set[str]] = None) -> List[Dict]:
+        """Fetch all meetings within a date range, leaving out any whose id is in skip_ids"""
+        return list(self.iter_meetings_in_date_range(start_date, end_date, skip_ids))
+
+    def iter_meetings_in_date_range(self, start_date: datetime, end_date: datetime,
+                                    skip_ids: Optional[Set[str]] = None) -> Iterator[Dict]:
+        """Yield meetings within a date range with their transcripts, in API order
+
+        Only a bounded window of transcripts is held at once, so callers that
+        process each meeting as it arrives don't keep every transcript in memory.
+        """
         # Make dates timezone-aware if they aren't already
         if start_date.tzinfo is None:
             start_date = start_date.replace(tzinfo=timezone.utc)
         if end_date.tzinfo is None:
             end_date = end_date.replace(tzinfo=timezone.utc)
+        # Compare as epoch seconds, cheaper than aware datetime comparisons per document
+        start_ts, end_ts = start_date.timestamp(), end_date.timestamp()
 
-        all_meetings = []
+        pending = deque()  # (doc, transcript future) in API order
         offset = 0
         limit = 100
 
-        while True:
-            documents = self.get_documents(limit=limit, offset=offset)
-
-            if not documents:
-                break
-
-            for doc in documents:
-                # Parse document creation date
-                created_at = datetime.fromisoformat(doc['created_at'].replace('Z', '+00:00'))
-
-                # Filter by date range
-                if start_date <= created_at <= end_date:
-                    # Fetch transcript for this document
-                    try:
-                        transcript = self.get_document_transcript(doc['id'])
-                        doc['transcript'] = transcript
-                        all_meetings.append(doc)
-                    except Exception as e:
-                        print(f"Warning: Failed to fetch transcript for {doc.get('title', 'Unknown')}: {e}")
-                        continue
-
-            # If we got fewer documents than requested, we've reached the end
-            if len(documents) < limit:
-                break
-
-            offset += limit
-
-        return all_meetings
+        # Transcripts are fetched in parallel while we keep paging. The API has no
+        # bulk transcript endpoint, so this is one request per document, multiplexed
+        # over the transcript client's HTTP/2 connection
+        with ThreadPoolExecutor(max_workers=self.TRANSCRIPT_CONCURRENCY) as pool, \
+                ThreadPoolExecutor(max_workers=self.PAGE_PREFETCH) as page_pool:
+            pages = deque([page_pool.submit(self.get_documents, limit=limit, offset=offset)])
+
+            try:
+                while pages:
+                    documents = pages.popleft().result()
+                    in_range, oldest_seen = self._page_in_range(documents, start_ts, end_ts)
+
+                    for doc in in_range:
+                        # Skip documents the caller already has
+                        if skip_ids and doc['id'] in skip_ids:
+                            continue
+
+                        # Fetch transcript for this document
+                        pending.append((doc, pool.submit(
+                            self.get_document_transcript, doc['id'], doc.get('updated_at')
+                        )))
+
+                        # Hand the oldest meetings over once the window is full
+                        while len(pending) > self.TRANSCRIPT_WINDOW:
+                            meeting = self._with_transcript(*pending.popleft())
+                            if meeting is not None:
+                                yield meeting
+
+                    # If we got fewer documents than requested, we've reached the end
+                    if len(documents) < limit:
+                        break
+
+                    # Documents come back newest first, so later pages are all before the range
+                    if oldest_seen < start_ts:
+                        break
+
+                    # A full page means there are probably more, so prefetch the next few
+                    while len(pages) < self.PAGE_PREFETCH:
+                        offset += limit
+                        pages.append(page_pool.submit(self.get_documents, limit=limit, offset=offset))
+
+                while pending:
+                    meeting = self._with_transcript(*pending.popleft())
+                    if meeting is not None:
+                        yield meeting
+
+            finally:
+                # Speculative pages past the end, and anything left if the caller stops early
+                for page in pages:
+                    page.cancel()
+                for _, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _page_in_range(documents: List[Dict], start_ts: float, end_ts: float) -> Tuple[List[Dict], Optional[float]]:
+        """Return the page's documents created within the range, and its oldest timestamp
+
+        Pages normally come back newest first with uniform UTC timestamps, so the
+        range is found by binary search, parsing only a handful of dates. Anything
+        else falls back to checking every document.
+        """
+        stamps = [doc['created_at'] for doc in documents]
+
+        # Same-length 'Z' timestamps sort as strings the way the times they encode do
+        uniform = len(set(map(len, stamps))) <= 1 and all(stamp.endswith('Z') for stamp in stamps)
+        if uniform and all(newer >= older for newer, older in zip(stamps, stamps[1:])):
+            def key(doc):
+                return -_FROMISO(doc['created_at']).timestamp()
+
+            lo = bisect_left(documents, -end_ts, key=key)
+            hi = bisect_right(documents, -start_ts, key=key)
+            oldest = _FROMISO(stamps[-1]).timestamp() if stamps else None
+            return documents[lo:hi], oldest
+
+        created = [_FROMISO(stamp).timestamp() for stamp in stamps]
+        in_range = [doc for doc, created_ts in zip(documents, created) if start_ts <= created_ts <= end_ts]
+        return in_range, min(created, default=None)
+
+    @staticmethod
+    def _with_transcript(doc: Dict, future) -> Optional[Dict]:
+        """Attach a fetched transcript to its document, None if the fetch failed"""
+        try:
+            doc['transcript'] = future.result()
+            return doc
+        except Exception as e:
+            print(f"Warning: Failed to fetch transcript for {doc.get('title', 'Unknown')}: {e}")
+            return None
 
     def format_transcript_text(self, transcript: List[Dict]) -> str:
         """Convert transcript utterances to readable text"""
         if not transcript:
             return ""
 
-        lines = []
-        for utterance in transcript:
-            speaker = utterance.get('source', 'Unknown')
-            text = utterance.get('text', '')
-            lines.append(f"{speaker}: {text}")
-
-        return "\n".join(lines)
+        return "\n".join([
+            f"{utterance.get('source', 'Unknown')}: {utterance.get('text', '')}" for utterance in transcript
+        ])
@@ -0,0 +1,125 @@
+"""
+Response cache for meeting analyses.
+
+Two tiers: an exact SHA256 match on the prompt, then a semantic match on
+the embedding of its variable part, limited to entries with the same scope,
+so near-identical meeting bundles reuse the earlier feedback.
+"""
+
+import hashlib
+import math
+import sqlite3
+from array import array
+from datetime import datetime
+from typing import List, Optional
+
+
+class SemanticCache:
+    """SQLite-backed exact + embedding similarity cache"""
+
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    SIMILARITY_THRESHOLD = 0.97
+    # text-embedding-3-small takes at most 8191 tokens, longer texts are embedded by their start
+    MAX_EMBEDDING_CHARS = 24000
+
+    def __init__(self, client, path: str, threshold: float = None):
+        """Initialize the cache; the database is created on first use"""
+        self.client = client
+        self.path = path
+        self.threshold = threshold if threshold is not None else self.SIMILARITY_THRESHOLD
+        self._conn = None
+        self._embeddings = {}  # embedded text key -> embedding computed by get(), reused by put()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the table if needed"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, embedding BLOB, response TEXT NOT NULL, created_at TEXT NOT NULL, scope TEXT)"
+            )
+            # Databases from before scopes existed; their rows only serve exact matches
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+            if 'scope' not in columns:
+                self._conn.execute("ALTER TABLE responses ADD COLUMN scope TEXT")
+        return self._conn
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        """Embed text (cut to MAX_EMBEDDING_CHARS), None if the API call fails"""
+        key = self._key(text)
+        if key in self._embeddings:
+            return self._embeddings[key]
+
+        try:
+            response = self.client.embeddings.create(
+                model=self.EMBEDDING_MODEL, input=text[:self.MAX_EMBEDDING_CHARS]
+            )
+            embedding = response.data[0].embedding
+        except Exception as e:
+            print(f"Warning: Could not embed prompt for cache lookup: {e}")
+            return None
+
+        self._embeddings[key] = embedding
+        return embedding
+
+    @staticmethod
+    def _cosine(a: List[float], b: List[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
+
+    def get(self, text: str, embed_text: Optional[str] = None, scope: Optional[str] = None) -> Optional[str]:
+        """Return a cached response for this prompt or a near-identical one
+
+        The similarity tier embeds `embed_text` (the whole prompt by default)
+        and only considers entries stored with the same `scope`.
+        """
+        key = self._key(text)
+
+        try:
+            conn = self._connect()
+
+            # Exact match first, no API call needed
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                return row[0]
+
+            embedding = self._embed(text if embed_text is None else embed_text)
+            if embedding is None:
+                return None
+
+            best_score, best_response = 0.0, None
+            for blob, response in conn.execute(
+                "SELECT embedding, response FROM responses WHERE embedding IS NOT NULL AND scope IS ?",
+                (scope,)
+            ):
+                score = self._cosine(embedding, array('f', blob))
+                if score > best_score:
+                    best_score, best_response = score, response
+
+            return best_response if best_score >= self.threshold else None
+
+        except sqlite3.Error as e:
+            print(f"Warning: Response cache lookup failed: {e}")
+            return None
+
+    def put(self, text: str, response: str, embed_text: Optional[str] = None, scope: Optional[str] = None):
+        """Store the response for this prompt, see get() for embed_text and scope"""
+        key = self._key(text)
+        embedding = self._embed(text if embed_text is None else embed_text)
+        blob = array('f', embedding).tobytes() if embedding is not None else None
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, embedding, response, created_at, scope) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, response, datetime.now().isoformat(), scope)
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to save response to cache: {e}")
@@ -4,17 +4,24 @@ Tests for Granola Meeting Analyzer
 Focuses on critical functionality and regression tests for bugs we encountered.
 """
 
+import asyncio
+import base64
 import json
+import httpx
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from unittest.mock import Mock, patch, mock_open
+from unittest.mock import AsyncMock, MagicMock, Mock, patch, mock_open
 import tempfile
 import os
 
+import granola_client
 from granola_client import GranolaClient
 from ai_analyzer import MeetingAnalyzer
+from semantic_cache import SemanticCache
 from analyze_meetings import MeetingAnalysisRunner
+from email_sender import EmailSender
 
 
 class TestGranolaClient:
@@ -36,6 +43,28 @@ class TestGranolaClient:
                 assert client.access_token == "test_access_token"
                 assert client.refresh_token == "test_refresh_token"
 
+    def test_refreshed_tokens_saved_in_granola_format(self):
+        """Refreshed tokens are written back nested and minified, keeping other fields"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            creds_path = os.path.join(tmpdir, 'supabase.json')
+            with open(creds_path, 'w') as f:
+                json.dump({
+                    "workos_tokens": json.dumps({"access_token": "old", "refresh_token": "old_refresh", "expires_in": 3600}),
+                    "user_info": {"email": "me@example.com"}
+                }, f)
+
+            with patch.object(GranolaClient, 'CREDENTIALS_PATH', creds_path):
+                client = GranolaClient()
+                client.access_token, client.refresh_token = "new", "new_refresh"
+                client._save_refresh_token()
+
+            with open(creds_path) as f:
+                saved = json.load(f)
+
+        assert saved["user_info"] == {"email": "me@example.com"}
+        assert saved["workos_tokens"] == '{"access_token":"new","refresh_token":"new_refresh","expires_in":3600}'
+        assert not os.path.exists(creds_path + '.tmp')
+
     def test_api_response_uses_docs_key(self):
         """Regression test: API returns 'docs' not 'documents'"""
         # This was a real bug - we used wrong key initially
@@ -53,6 +82,14 @@ class TestGranolaClient:
             assert len(result) == 2
             assert result[0]["title"] == "Meeting 1"
 
+    def test_non_json_body_reported_as_request_failure(self):
+        """An HTML error page with a 200 status surfaces as a failed API request"""
+        client = GranolaClient()
+
+        with patch.object(client.session, 'post', return_value=Mock(status_code=200, content=b'<html>Bad gateway</html>')):
+            with pytest.raises(Exception, match="API request failed"):
+                client.get_documents()
+
     def test_transcript_returns_list_directly(self):
         """Regression test: transcript API returns list, not dict with 'utterances'"""
         # This was a real bug - we tried to access .get('utterances')
@@ -69,6 +106,27 @@ class TestGranolaClient:
             assert len(result) == 2
             assert result[0]["source"] == "Alice"
 
+    def test_transcript_cached_until_document_updates(self):
+        """Cached transcripts are reused until the document's updated_at moves past them"""
+        client = GranolaClient()
+        mock_transcript = [{"source": "Alice", "text": "Hello"}]
+        earlier = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        later = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client.TRANSCRIPT_CACHE_DIR = os.path.join(tmpdir, 'transcripts')
+            with patch.object(client, '_make_request', return_value=mock_transcript) as mock_request:
+                assert client.get_document_transcript("doc1", earlier) == mock_transcript
+                assert client.get_document_transcript("doc1", earlier) == mock_transcript
+                assert mock_request.call_count == 1
+
+                # Transcripts are private to the user
+                assert os.stat(client.TRANSCRIPT_CACHE_DIR).st_mode & 0o777 == 0o700
+                assert os.stat(client._transcript_cache_path("doc1")).st_mode & 0o777 == 0o600
+
+                client.get_document_transcript("doc1", later)
+                assert mock_request.call_count == 2
+
     def test_date_filtering_timezone_aware(self):
         """Regression test: timezone-aware datetime comparison"""
         # This was a real bug - comparing naive and aware datetimes
@@ -94,6 +152,199 @@ class TestGranolaClient:
                 result = client.get_meetings_in_date_range(start, end)
                 assert len(result) == 2
 
+    def test_z_suffixed_timestamps_filtered(self):
+        """API timestamps end in 'Z', which fromisoformat only accepts natively on 3.11+"""
+        client = GranolaClient()
+        mock_docs = [
+            {"id": "1", "created_at": "2025-01-15T10:00:00.000Z", "title": "In range"},
+            {"id": "2", "created_at": "2025-01-13T10:00:00Z", "title": "Too early"}
+        ]
+
+        with patch.object(client, 'get_documents', return_value=mock_docs):
+            with patch.object(client, 'get_document_transcript', return_value=[]):
+                result = client.get_meetings_in_date_range(datetime(2025, 1, 14), datetime(2025, 1, 16))
+
+        assert [doc["id"] for doc in result] == ["1"]
+
+    def test_sorted_page_range_found_by_bisect(self):
+        """A newest-first page of uniform UTC timestamps is sliced without parsing every date"""
+        base_time = datetime(2025, 1, 15, tzinfo=timezone.utc)
+        documents = [
+            {"id": str(i), "created_at": (base_time - timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+            for i in range(100)
+        ]
+        start_ts = (base_time - timedelta(hours=60)).timestamp()
+        end_ts = (base_time - timedelta(hours=20)).timestamp()
+
+        with patch.object(granola_client, '_FROMISO', wraps=granola_client._FROMISO) as mock_parse:
+            in_range, oldest = GranolaClient._page_in_range(documents, start_ts, end_ts)
+
+        assert [doc["id"] for doc in in_range] == [str(i) for i in range(20, 61)]
+        assert oldest == (base_time - timedelta(hours=99)).timestamp()
+        assert mock_parse.call_count < 20
+
+        # Unsorted pages still filter correctly
+        shuffled = documents[::2] + documents[1::2]
+        in_range, oldest = GranolaClient._page_in_range(shuffled, start_ts, end_ts)
+        assert sorted(int(doc["id"]) for doc in in_range) == list(range(20, 61))
+        assert oldest == (base_time - timedelta(hours=99)).timestamp()
+
+    def test_skip_ids_avoid_transcript_fetch(self):
+        """Already-processed documents are dropped before their transcript is requested"""
+        client = GranolaClient()
+        base_time = datetime.now(timezone.utc)
+        mock_docs = [
+            {"id": "1", "created_at": base_time.isoformat(), "title": "Meeting 1"},
+            {"id": "2", "created_at": base_time.isoformat(), "title": "Meeting 2"}
+        ]
+
+        with patch.object(client, 'get_documents', return_value=mock_docs):
+            with patch.object(client, 'get_document_transcript', return_value=[]) as mock_transcript:
+                result = client.get_meetings_in_date_range(
+                    base_time - timedelta(days=1), base_time + timedelta(hours=1), skip_ids={"1"}
+                )
+
+        assert [doc["id"] for doc in result] == ["2"]
+        assert mock_transcript.call_count == 1
+
+    def test_prefetched_pages_keep_api_order(self):
+        """Pages fetched ahead of time are still consumed in offset order"""
+        client = GranolaClient()
+        base_time = datetime.now(timezone.utc)
+        all_docs = [
+            {"id": str(i), "created_at": (base_time - timedelta(minutes=i)).isoformat(), "title": f"Meeting {i}"}
+            for i in range(250)
+        ]
+
+        def get_documents(limit=100, offset=0):
+            return all_docs[offset:offset + limit]
+
+        with patch.object(client, 'get_documents', side_effect=get_documents):
+            with patch.object(client, 'get_document_transcript', return_value=[]):
+                result = client.get_meetings_in_date_range(base_time - timedelta(days=1), base_time)
+
+        assert [doc["id"] for doc in result] == [str(i) for i in range(250)]
+
+    def test_iter_meetings_yields_before_all_pages_read(self):
+        """The iterator hands meetings over once the transcript window fills"""
+        client = GranolaClient()
+        client.TRANSCRIPT_WINDOW = 2
+        base_time = datetime.now(timezone.utc)
+        all_docs = [
+            {"id": str(i), "created_at": (base_time - timedelta(minutes=i)).isoformat(), "title": f"Meeting {i}"}
+            for i in range(250)
+        ]
+
+        def get_documents(limit=100, offset=0):
+            return all_docs[offset:offset + limit]
+
+        with patch.object(client, 'get_documents', side_effect=get_documents):
+            with patch.object(client, 'get_document_transcript', return_value=[{"source": "A", "text": "B"}]):
+                meetings = client.iter_meetings_in_date_range(base_time - timedelta(days=1), base_time)
+                first = next(meetings)
+                meetings.close()
+
+        assert first["id"] == "0"
+        assert first["transcript"] == [{"source": "A", "text": "B"}]
+
+    def test_paging_stops_once_past_start_date(self):
+        """Newest-first pages older than the range are not walked to the end"""
+        client = GranolaClient()
+        base_time = datetime.now(timezone.utc)
+        all_docs = [
+            {"id": str(i), "created_at": (base_time - timedelta(hours=i)).isoformat(), "title": f"Meeting {i}"}
+            for i in range(1000)
+        ]
+        offsets = []
+
+        def get_documents(limit=100, offset=0):
+            offsets.append(offset)
+            return all_docs[offset:offset + limit]
+
+        with patch.object(client, 'get_documents', side_effect=get_documents):
+            with patch.object(client, 'get_document_transcript', return_value=[]):
+                result = client.get_meetings_in_date_range(base_time - timedelta(hours=150), base_time)
+
+        assert len(result) == 151
+        # Only the prefetch window past the boundary page may have been requested
+        assert max(offsets) <= 100 + client.PAGE_PREFETCH * 100
+
+    def test_concurrent_401s_refresh_token_once(self):
+        """Transcripts fetched in parallel must not burn the one-time refresh token twice"""
+        client = GranolaClient()
+        client.access_token = "stale"
+
+        def post(url, content=None, headers=None):
+            stale = headers["Authorization"] == "Bearer stale"
+            return Mock(status_code=401 if stale else 200, content=b'[{"source": "Alice", "text": "Hi"}]')
+
+        def refresh():
+            client.access_token = "fresh"
+
+        with patch.object(client._transcript_client, 'post', side_effect=post):
+            with patch.object(client, '_refresh_access_token', side_effect=refresh) as mock_refresh:
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    results = list(pool.map(client.get_document_transcript, ["1", "2", "3", "4"]))
+
+        assert all(r == [{"source": "Alice", "text": "Hi"}] for r in results)
+        assert mock_refresh.call_count == 1
+
+    def test_api_posts_retried_but_token_refresh_is_not(self):
+        """Rate-limited API calls back off and retry; the one-time token refresh never replays"""
+        client = GranolaClient()
+
+        api_retry = client.session.get_adapter(f"{client.API_BASE}/v2/get-documents").max_retries
+        assert api_retry.is_retry("POST", 429)
+        assert api_retry.is_retry("POST", 503, has_retry_after=True)
+
+        refresh_retry = client.session.get_adapter(client.WORKOS_AUTH_URL).max_retries
+        assert refresh_retry.total == 0
+
+    def test_transcripts_fetched_over_http2_with_backoff(self):
+        """Transcript calls go through the HTTP/2 client, which backs off on 503s like the session"""
+        client = GranolaClient()
+        client.access_token = "token"
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            if len(requests_seen) == 1:
+                return httpx.Response(503, headers={"Retry-After": "0"})
+            return httpx.Response(200, json=[{"source": "Alice", "text": "Hi"}])
+
+        client._transcript_client = httpx.Client(transport=httpx.MockTransport(handler))
+
+        with patch.object(client.session, 'post') as mock_session_post:
+            with patch('granola_client.time.sleep') as mock_sleep:
+                assert client.get_document_transcript("doc1") == [{"source": "Alice", "text": "Hi"}]
+
+        mock_session_post.assert_not_called()
+        mock_sleep.assert_called_once_with(0.0)
+        assert len(requests_seen) == 2
+        assert requests_seen[-1].url == f"{client.API_BASE}/v1/get-document-transcript"
+        assert requests_seen[-1].headers["Authorization"] == "Bearer token"
+        assert json.loads(requests_seen[-1].content) == {"document_id": "doc1"}
+
+    def test_expired_token_refreshed_before_request(self):
+        """A saved token past its JWT exp is refreshed up front instead of after a 401"""
+        client = GranolaClient()
+        exp = int((datetime.now(timezone.utc) - timedelta(minutes=5)).timestamp())
+        claims = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip('=')
+        client.access_token = f"header.{claims}.signature"
+        client._access_expiry = client._token_expiry(client.access_token)
+        assert client._access_expiry is not None
+
+        def refresh():
+            client.access_token = "fresh"
+            client._access_expiry = None
+
+        with patch.object(client.session, 'post', return_value=Mock(status_code=200, content=b'{"docs": []}')) as mock_post:
+            with patch.object(client, '_refresh_access_token', side_effect=refresh) as mock_refresh:
+                client.get_documents()
+
+        assert mock_refresh.call_count == 1
+        assert mock_post.call_count == 1
+
     def test_transcript_formatting(self):
         """Test transcript text formatting works correctly"""
         client = GranolaClient()
@@ -142,6 +393,296 @@ class TestMeetingAnalyzer:
             assert 'No meetings' in result['summary']
             assert result['feedback'] == 'No meetings to analyze.'
 
+    def test_system_prompt_is_static_for_prompt_caching(self):
+        """Test run-specific content only goes in the user message"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key', 'PEOPLE': 'Alice is my manager'}):
+            analyzer = MeetingAnalyzer()
+
+        meetings = [{"id": "1", "title": "Standup", "transcript_text": "Alice: Status"}]
+        first = analyzer._build_messages(meetings, previous_feedback="Talk less")
+        second = analyzer._build_messages([], previous_feedback=None)
+
+        assert first[0] == second[0]
+        assert "Guidelines:" in first[0]['content']
+        for dynamic in ("Alice is my manager", "Talk less", "Alice: Status"):
+            assert dynamic not in first[0]['content']
+            assert dynamic in first[1]['content']
+
+    def test_meetings_analyzed_individually_then_combined(self):
+        """Test per-meeting fan-out feeds its notes into one combined report"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key'}):
+            analyzer = MeetingAnalyzer()
+
+        meetings = [
+            {"id": "1", "title": "Standup", "transcript_text": "Alice: Status"},
+            {"id": "2", "title": "Dentist", "transcript_text": "Bob: Open wide"},
+            {"id": "3", "title": "Planning", "transcript_text": "Carol: Roadmap"}
+        ]
+
+        def completion(content):
+            return Mock(choices=[Mock(message=Mock(content=content))])
+
+        async def per_meeting(model, messages):
+            transcript = messages[-1]['content']
+            if "Open wide" in transcript:
+                return completion("SKIP")
+            return completion("notes for " + transcript.splitlines()[-1])
+
+        async_client = MagicMock()
+        async_client.__aenter__.return_value = async_client
+        async_client.chat.completions.create = AsyncMock(side_effect=per_meeting)
+        analyzer.client = Mock()
+        analyzer.client.chat.completions.create.return_value = completion("Daily report")
+        analyzer.cache = None
+
+        with patch('ai_analyzer.AsyncOpenAI', return_value=async_client):
+            result = analyzer.analyze_meetings(meetings)
+
+        assert result['feedback'] == "Daily report"
+        assert async_client.chat.completions.create.await_count == 3
+
+        reduce_prompt = analyzer.client.chat.completions.create.call_args.kwargs['messages'][-1]['content']
+        assert "notes for Alice: Status" in reduce_prompt
+        assert "notes for Carol: Roadmap" in reduce_prompt
+        assert "Dentist" not in reduce_prompt
+
+    def test_oversized_transcript_split_to_token_budget(self):
+        """Test transcripts over the token budget are analyzed in parts"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key'}):
+            analyzer = MeetingAnalyzer()
+        analyzer.MAX_PROMPT_TOKENS = 10
+
+        meeting = {"id": "1", "title": "Offsite", "transcript_text": "\n".join(
+            f"Alice: point number {i}" for i in range(6)
+        )}
+
+        # One token per word keeps the test independent of the tiktoken download
+        with patch.object(analyzer, '_count_tokens', side_effect=lambda text: len(text.split())):
+            parts = analyzer._split_transcript(meeting)
+
+            assert len(parts) == 3
+            assert "\n".join(parts) == meeting['transcript_text']
+            assert meeting['transcript_tokens'] == 24
+
+            with pytest.raises(ValueError):
+                analyzer.submit_batch([meeting])
+
+    def test_long_line_and_reduce_prompt_cut_by_tokens(self):
+        """A single line over the budget is cut by tokens, and the report notes are trimmed to fit"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key'}):
+            analyzer = MeetingAnalyzer()
+        analyzer.MAX_PROMPT_TOKENS = 1000
+
+        # One token per character keeps the test independent of the tiktoken download
+        encoding = Mock(encode=lambda text, disallowed_special=(): list(text), decode=''.join)
+        with patch('ai_analyzer._get_encoding', return_value=encoding):
+            meeting = {"id": "1", "title": "Dictation", "transcript_text": "Hi\n" + "a" * 2500 + "\nBye"}
+            parts = analyzer._split_transcript(meeting)
+            assert [len(part) for part in parts] == [2, 1000, 1000, 500, 3]
+            assert all(analyzer._count_tokens(part) <= analyzer.MAX_PROMPT_TOKENS for part in parts)
+
+            meetings = [{"id": str(i), "title": f"Meeting {i}"} for i in range(3)]
+            overhead = sum(len(m['content']) for m in analyzer._build_messages(meetings, "Talk less", texts=[''] * 3))
+            analyzer.MAX_PROMPT_TOKENS = overhead + 1000
+            notes = ["short", "b" * 2000, "c" * 900]
+            fitted = analyzer._fit_report_notes(meetings, notes, "Talk less")
+
+            assert fitted[0] == "short"
+            # The two long notes split what the short one left over
+            assert [len(note) for note in fitted[1:]] == [498, 497]
+            messages = analyzer._build_messages(meetings, "Talk less", texts=fitted)
+            assert sum(analyzer._count_tokens(m['content']) for m in messages) <= analyzer.MAX_PROMPT_TOKENS
+
+    def test_batch_submit_and_collect(self):
+        """Test batch request format and that pending batches return None"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key'}):
+            analyzer = MeetingAnalyzer()
+
+        meetings = [{"id": "doc1", "title": "Standup", "transcript_text": "Alice: Hi"}]
+        analyzer.client = Mock()
+        analyzer.client.files.create.return_value = Mock(id="file_1")
+        analyzer.client.batches.create.return_value = Mock(id="batch_1")
+
+        batch = analyzer.submit_batch(meetings)
+
+        assert batch['batch_id'] == "batch_1"
+        assert batch['meeting_ids'] == ["doc1"]
+        _, content = analyzer.client.files.create.call_args.kwargs['file']
+        request = json.loads(content)
+        assert request['custom_id'] == batch['date']
+        assert request['url'] == "/v1/chat/completions"
+        assert "Alice: Hi" in request['body']['messages'][-1]['content']
+
+        # Still running
+        analyzer.client.batches.retrieve.return_value = Mock(status="in_progress")
+        assert analyzer.collect_batch(batch) is None
+
+        # Finished
+        output_line = {"custom_id": batch['date'], "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": "Great meeting"}}]
+        }}}
+        analyzer.client.batches.retrieve.return_value = Mock(status="completed", output_file_id="file_2")
+        analyzer.client.files.content.return_value = Mock(text=json.dumps(output_line) + "\n")
+
+        result = analyzer.collect_batch(batch)
+        assert result['feedback'] == "Great meeting"
+        assert result['date'] == batch['date']
+        assert 'error' not in result
+
+        # Completed, but the one request failed and only an error file was written
+        error_line = {"custom_id": batch['date'], "response": {"status_code": 400, "body": {
+            "error": {"message": "Context too long"}
+        }}}
+        analyzer.client.batches.retrieve.return_value = Mock(
+            status="completed", output_file_id=None, error_file_id="file_3"
+        )
+        analyzer.client.files.content.return_value = Mock(text=json.dumps(error_line) + "\n")
+        assert analyzer.collect_batch(batch)['error'] == "Context too long"
+        analyzer.client.files.content.assert_called_with("file_3")
+
+        # Expired
+        analyzer.client.batches.retrieve.return_value = Mock(status="expired")
+        assert analyzer.collect_batch(batch)['error'] == "batch expired"
+
+
+class TestSemanticCache:
+    """Test the analysis response cache"""
+
+    def test_exact_then_similar_match(self):
+        """Test exact hits skip embedding and near-identical prompts reuse feedback"""
+        embeddings = {
+            "today's meetings": [1.0, 0.0, 0.0],
+            "today's meetings, slightly edited": [0.99, 0.01, 0.0],
+            "something else entirely": [0.0, 1.0, 0.0]
+        }
+        client = Mock()
+        client.embeddings.create.side_effect = lambda model, input: Mock(
+            data=[Mock(embedding=embeddings[input])]
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = SemanticCache(client, str(Path(tmpdir) / 'cache.sqlite'))
+            assert cache.get("today's meetings") is None
+            cache.put("today's meetings", "Great feedback")
+
+            client.embeddings.create.reset_mock()
+            assert cache.get("today's meetings") == "Great feedback"
+            client.embeddings.create.assert_not_called()
+
+            assert cache.get("today's meetings, slightly edited") == "Great feedback"
+            assert cache.get("something else entirely") is None
+
+    def test_similar_match_embeds_meetings_and_requires_same_scope(self):
+        """Test the shared instructions aren't embedded and other meetings never reuse feedback"""
+        client = Mock()
+        client.embeddings.create.side_effect = lambda model, input: Mock(
+            data=[Mock(embedding={"standup": [1.0, 0.0], "standup, edited": [0.99, 0.01]}[input])]
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = SemanticCache(client, str(Path(tmpdir) / 'cache.sqlite'))
+            cache.put("INSTRUCTIONS standup", "Monday feedback", "standup", "doc1")
+
+            assert cache.get("INSTRUCTIONS standup, edited", "standup, edited", "doc1") == "Monday feedback"
+            assert cache.get("INSTRUCTIONS standup, edited", "standup, edited", "doc2") is None
+            assert {c.kwargs['input'] for c in client.embeddings.create.call_args_list} == {"standup", "standup, edited"}
+
+    def test_long_meetings_embedded_as_bounded_digest(self):
+        """Long transcripts still get a similarity entry, from their start and end"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test_key'}):
+            analyzer = MeetingAnalyzer()
+        analyzer.EMBEDDING_DIGEST_TOKENS = 200
+
+        meetings = [
+            {"id": "1", "title": "Offsite", "transcript_text": "START" + "x" * 5000 + "END"},
+            {"id": "2", "title": "Standup", "transcript_text": "Alice: Status"}
+        ]
+        # One token per character keeps the test independent of the tiktoken download
+        encoding = Mock(encode=lambda text, disallowed_special=(): list(text), decode=''.join)
+        with patch('ai_analyzer._get_encoding', return_value=encoding):
+            digest = analyzer._embedding_digest(meetings)
+
+        assert "Offsite" in digest and "START" in digest and "END" in digest
+        assert "Alice: Status" in digest
+        assert len(digest) < 1000
+
+        # The cache itself embeds the start of anything still too long instead of skipping it
+        client = Mock()
+        client.embeddings.create.return_value = Mock(data=[Mock(embedding=[1.0, 0.0])])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = SemanticCache(client, str(Path(tmpdir) / 'cache.sqlite'))
+            cache.put("prompt", "Feedback", "y" * 30000, "1,2")
+            assert cache.get("other prompt", "y" * 30000, "1,2") == "Feedback"
+        assert len(client.embeddings.create.call_args.kwargs['input']) == SemanticCache.MAX_EMBEDDING_CHARS
+
+
+class TestEmailSender:
+    """Test HTML email formatting"""
+
+    EMAIL_ENV = {'RESEND_API_KEY': 'test_key', 'FROM_EMAIL': 'from@example.com', 'RECIPIENT_EMAIL': 'to@example.com'}
+
+    def test_report_lines_formatted_by_kind(self):
+        """Test each report line kind gets its HTML element and text is escaped"""
+        with patch.dict(os.environ, self.EMAIL_ENV):
+            sender = EmailSender()
+
+        report = "\n".join([
+            "=" * 80,
+            "TOP 3 STRENGTHS",
+            "  Meeting: Standup <daily>",
+            "1. Clear agenda",
+            "- Follow up with Bob",
+            "",
+            "Plain text & more",
+            "-" * 40,
+        ])
+
+        html = sender._format_html_email(report)
+
+        assert '<hr style="border: 2px solid #333; margin: 20px 0;">' in html
+        assert '<h2 style="color: #2563eb; margin-top: 20px;">TOP 3 STRENGTHS</h2>' in html
+        assert '<h3 style="color: #1e40af; margin-top: 15px;">Meeting: Standup &lt;daily&gt;</h3>' in html
+        assert '<p style="margin-left: 20px; line-height: 1.6;">1. Clear agenda</p>' in html
+        assert '<p style="margin-left: 20px; line-height: 1.6;">- Follow up with Bob</p>' in html
+        assert '<br>' in html
+        assert '<p style="line-height: 1.6;">Plain text &amp; more</p>' in html
+        assert '<hr style="border: 1px solid #666; margin: 15px 0;">' in html
+
+    def test_async_send_posts_to_resend(self):
+        """Test the async sender posts the same payload as the sync one"""
+        with patch.dict(os.environ, self.EMAIL_ENV):
+            sender = EmailSender()
+
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return httpx.Response(200, json={"id": "email_1"})
+
+        sender._httpx = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def send():
+            try:
+                return await sender.send_analysis_report_async("No meetings found in the specified date range.", "Today")
+            finally:
+                await sender.aclose()
+
+        assert asyncio.run(send())
+        assert str(requests_seen[0].url) == EmailSender.RESEND_API_URL
+        assert requests_seen[0].headers['Authorization'] == "Bearer test_key"
+        payload = json.loads(requests_seen[0].content)
+        assert payload == sender._build_report_params("No meetings found in the specified date range.", "Today")
+
+    def test_sync_send_uses_resend_sdk(self):
+        """Test the blocking send posts the same payload through the resend SDK"""
+        with patch.dict(os.environ, self.EMAIL_ENV):
+            sender = EmailSender()
+
+        with patch('email_sender.resend.Emails.send', return_value={'id': 'email_1'}) as send:
+            assert sender.send_analysis_report("Summary: Analyzed 1 meetings", "Today")
+
+        assert send.call_args[0][0] == sender._build_report_params("Summary: Analyzed 1 meetings", "Today")
+
 
 class TestMeetingAnalysisRunner:
     """Test the main orchestration logic"""
@@ -165,11 +706,103 @@ class TestMeetingAnalysisRunner:
 
                 # Mark new document as processed
                 runner._mark_as_processed("doc3")
+                assert runner._is_processed("doc3")
+                runner._save_state()
 
                 # Should be persisted
                 saved_state = json.loads(state_file.read_text())
                 assert "doc3" in saved_state["processed_documents"]
 
+    def test_expired_batch_dropped_without_publishing(self):
+        """An expired batch must not become feedback or mark its meetings processed"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_file = Path(tmpdir) / '.analysis_state.json'
+            state_file.write_text(json.dumps({"processed_documents": [], "pending_batches": [
+                {"batch_id": "batch_1", "date": "2025-01-15", "num_meetings": 1, "meeting_ids": ["doc1"]}
+            ]}))
+
+            with patch('analyze_meetings.STATE_FILE', str(state_file)):
+                runner = MeetingAnalysisRunner()
+                runner.analyzer.client = Mock()
+                runner.analyzer.client.batches.retrieve.return_value = Mock(status="expired")
+
+                with patch.object(runner, '_publish_analysis') as mock_publish:
+                    assert runner.collect_batches(send_email=False) == 0
+
+                mock_publish.assert_not_called()
+                assert not runner._is_processed("doc1")
+                assert json.loads(state_file.read_text())["pending_batches"] == []
+
+    def test_unreachable_batch_kept_and_published_batch_saved_immediately(self):
+        """A batch that can't be checked stays pending; a published one leaves the saved state right away"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_file = Path(tmpdir) / '.analysis_state.json'
+            state_file.write_text(json.dumps({"processed_documents": [], "pending_batches": [
+                {"batch_id": "batch_1", "date": "2025-01-15", "num_meetings": 1, "meeting_ids": ["doc1"]},
+                {"batch_id": "batch_2", "date": "2025-01-16", "num_meetings": 1, "meeting_ids": ["doc2"]},
+                {"batch_id": "batch_3", "date": "2025-01-17", "num_meetings": 1, "meeting_ids": ["doc3"]}
+            ]}))
+
+            with patch('analyze_meetings.STATE_FILE', str(state_file)):
+                runner = MeetingAnalysisRunner()
+
+                def collect(batch):
+                    if batch['batch_id'] == "batch_1":
+                        raise ConnectionError("network down")
+                    return {"summary": "Analyzed 1 meetings", "feedback": "Good", "date": batch['date']}
+
+                def publish(analysis_result, date_range_str, meeting_ids, send_email, **kwargs):
+                    if meeting_ids == ["doc3"]:
+                        raise OSError("disk full")
+                    runner._processed.update(meeting_ids)
+                    runner._save_state()
+
+                with patch.object(runner.analyzer, 'collect_batch', side_effect=collect):
+                    with patch.object(runner, '_publish_analysis', side_effect=publish):
+                        with pytest.raises(OSError):
+                            runner.collect_batches(send_email=False)
+
+                saved_state = json.loads(state_file.read_text())
+                assert [b['batch_id'] for b in saved_state["pending_batches"]] == ["batch_1", "batch_3"]
+                assert saved_state["processed_documents"] == ["doc2"]
+
+    def test_new_only_skips_meetings_in_pending_batches(self):
+        """Meetings already submitted in a batch aren't fetched or submitted again"""
+        runner = MeetingAnalysisRunner()
+        runner._processed = {"doc1"}
+        runner.state["pending_batches"] = [{"batch_id": "batch_1", "meeting_ids": ["doc2"]}]
+
+        with patch.object(runner.granola_client, 'iter_meetings_in_date_range') as mock_iter:
+            runner.fetch_meetings(datetime(2025, 1, 15), datetime(2025, 1, 16), new_only=True)
+
+        assert mock_iter.call_args.kwargs['skip_ids'] == {"doc1", "doc2"}
+
+    def test_transcript_compression(self):
+        """Test fillers, duplicates and same-speaker runs are compressed"""
+        runner = MeetingAnalysisRunner()
+
+        transcript = "\n".join([
+            "microphone: Um, so I I I think we should ship the release on Friday",
+            "system: So I think we should ship the release on Friday",
+            "microphone: uh, after the review.",
+            "system: Yeah.",
+            "system: Yeah.",
+            "microphone: I like the plan"
+        ])
+
+        compressed = runner._compress_transcript(transcript)
+
+        assert compressed.split("\n") == [
+            "microphone: so I think we should ship the release on Friday after the review.",
+            "system: Yeah. Yeah.",
+            "microphone: I like the plan"
+        ]
+
+        # Sentence punctuation, hyphenated backchannels and repeated numbers survive
+        assert runner._compress_transcript("A: It was um.\nB: Uh-huh, that works.\nA: 1 1 1 plan") == (
+            "A: It was.\nB: Uh-huh, that works.\nA: 1 1 1 plan"
+        )
+
     def test_feedback_versioning_with_dated_files(self):
         """Test that feedback is saved with dates and current.txt"""
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -182,6 +815,7 @@ class TestMeetingAnalysisRunner:
 
                     feedback_text = "This is test feedback"
                     runner._save_feedback(feedback_text)
+                    runner._flush_writes()
 
                     # Check dated file exists
                     today = datetime.now().strftime("%Y%m%d")
@@ -211,6 +845,7 @@ class TestMeetingAnalysisRunner:
 
                     # Save new feedback
                     runner._save_feedback("Second run")
+                    runner._flush_writes()
 
                     # Check backup was created
                     backup_files = list(feedback_dir.glob(f"feedback_{today}_backup_*.txt"))
@@ -244,6 +879,58 @@ class TestMeetingAnalysisRunner:
                 assert "3 days ago" in previous
                 assert "8 days ago" not in previous
 
+    def test_previous_feedback_from_rolling_context(self):
+        """Test saved feedback is rolled into one context file for later runs"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            feedback_dir = Path(tmpdir)
+
+            with patch('analyze_meetings.FEEDBACK_DIR', str(feedback_dir)):
+                with patch('analyze_meetings.CURRENT_FEEDBACK_FILE', str(feedback_dir / 'current.txt')):
+                    runner = MeetingAnalysisRunner()
+
+                    today = datetime.now()
+                    for days_ago in [8, 5, 4, 3, 2, 1]:
+                        feedback_date = today - timedelta(days=days_ago)
+                        runner._save_feedback(f"Feedback from {days_ago} days ago\n\nWith paragraphs", feedback_date=feedback_date)
+                    runner._save_feedback("Feedback from today")
+                    runner._flush_writes()
+
+                    assert (feedback_dir / 'rolling_context.txt').exists()
+
+                    # Dated files are ignored when the rolling context exists
+                    (feedback_dir / 'feedback_20000101.txt').write_text("Ancient feedback")
+
+                    previous = runner._load_previous_feedback()
+                    assert previous is not None
+                    assert "1 days ago\n\nWith paragraphs" in previous
+                    assert "2 days ago" in previous
+                    assert "3 days ago" in previous
+                    assert "4 days ago" not in previous
+                    assert "today" not in previous
+                    assert "Ancient" not in previous
+
+    def test_rolling_context_seeded_from_existing_feedback(self):
+        """Test the first rolling context keeps earlier days written before it existed"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            feedback_dir = Path(tmpdir)
+            today = datetime.now()
+            for days_ago in [4, 3, 2]:
+                day = (today - timedelta(days=days_ago)).strftime("%Y%m%d")
+                (feedback_dir / f"feedback_{day}.txt").write_text(f"Feedback from {days_ago} days ago")
+
+            with patch('analyze_meetings.FEEDBACK_DIR', str(feedback_dir)):
+                with patch('analyze_meetings.CURRENT_FEEDBACK_FILE', str(feedback_dir / 'current.txt')):
+                    runner = MeetingAnalysisRunner()
+                    runner._save_feedback("Feedback from 1 days ago", feedback_date=today - timedelta(days=1))
+                    runner._flush_writes()
+
+                    assert (feedback_dir / 'rolling_context.txt').exists()
+                    previous = runner._load_previous_feedback()
+                    assert "1 days ago" in previous
+                    assert "2 days ago" in previous
+                    assert "3 days ago" in previous
+                    assert "4 days ago" not in previous
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])